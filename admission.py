@@ -0,0 +1,93 @@
+from loguru import logger
+import threading
+import time
+
+LOG = logger.debug
+
+
+class AdmissionController:
+    """
+    Hold new submissions while the workflows of this run keep too many jobs
+    active in CUBE.
+
+    Every workflow posted by the run is tracked. Once the number of created,
+    waiting, scheduled, started or registering jobs reaches ``high_water``,
+    ``wait`` blocks until the count drops to ``low_water`` again. Workflow
+    statuses are refreshed at most once per ``interval`` seconds; in between,
+    newly posted workflows are added to the estimate with all of their jobs.
+    Setting ``cancel_event`` releases every held submission.
+    """
+
+    def __init__(self, pipe, high_water: int, low_water: int = 0, interval: int = 10,
+                 cancel_event: threading.Event = None):
+        self.pipe = pipe
+        self.high_water = high_water
+        self.low_water = low_water if 0 < low_water < high_water else high_water // 2
+        self.interval = interval
+        self.cancel_event = cancel_event if cancel_event is not None else threading.Event()
+        self.workflows: dict[int, int] = {}
+        self.paused = False
+        self.last_refresh = 0.0
+        self.lock = threading.Lock()
+
+    def track(self, workflow_id: int, total_jobs: int):
+        """
+        Register a newly posted workflow as fully active.
+        """
+        with self.lock:
+            self.workflows[workflow_id] = total_jobs
+
+    def tracked(self) -> list[int]:
+        """
+        Return the IDs of the workflows that may still have active jobs.
+        """
+        with self.lock:
+            return list(self.workflows)
+
+    def active_jobs(self) -> int:
+        """
+        Return the number of in-flight jobs, refreshing stale workflow statuses.
+        """
+        if time.monotonic() - self.last_refresh >= self.interval:
+            self._refresh()
+        with self.lock:
+            return sum(self.workflows.values())
+
+    def wait(self):
+        """
+        Block while the run is above the high-water mark, until it drains to the low-water mark
+        or the run is cancelled.
+        Without a high-water mark nothing blocks, but drained workflows are still pruned
+        so that ``tracked`` only lists those that may need cancelling.
+        """
+        if self.high_water <= 0:
+            self.active_jobs()
+            return
+        while True:
+            active = self.active_jobs()
+            if self.paused and active <= self.low_water:
+                self.paused = False
+                logger.info(f"Resuming submissions with {active} active jobs")
+            elif not self.paused and active >= self.high_water:
+                self.paused = True
+                logger.info(f"Holding submissions with {active} active jobs")
+            if not self.paused or self.cancel_event.wait(self.interval):
+                return
+
+    def _refresh(self):
+        with self.lock:
+            l_workflow = list(self.workflows)
+            # claimed up front so that concurrent callers don't refresh the same statuses
+            self.last_refresh = time.monotonic()
+        for workflow_id in l_workflow:
+            try:
+                active = self.pipe._get_workflow_status(workflow_id)["active_jobs"]
+            except Exception as ex:
+                LOG(f"Could not refresh status of workflow {workflow_id}: {ex}")
+                continue
+            with self.lock:
+                if active:
+                    self.workflows[workflow_id] = active
+                else:
+                    self.workflows.pop(workflow_id, None)
+        self.last_refresh = time.monotonic()
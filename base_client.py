@@ -7,7 +7,7 @@ class BaseClient(ABC):
         pass
 
     @abstractmethod
-    def anonymize(self, params: dict, pv_id: int):
+    def anonymize(self, job, pv_id: int, config):
         pass
 
     @abstractmethod
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+"""
+Microbenchmarks for the pure transformation helpers of dyanon.
+
+Each helper runs on synthetic inputs from small to very large. Wall time (best
+of several repeats) and peak allocated memory (tracemalloc) are recorded per
+case. Times are stored relative to a fixed pure-Python calibration loop so that
+baselines can be compared across machines.
+
+Usage:
+    python benchmarks/bench_transforms.py            # compare against baseline.json
+    python benchmarks/bench_transforms.py --update   # rewrite baseline.json
+    python benchmarks/bench_transforms.py -k sanitize --sizes small,medium
+"""
+
+from argparse import ArgumentParser
+from pathlib import Path
+import copy
+import json
+import sys
+import time
+import tracemalloc
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO))
+
+import pandas as pd
+
+import pfdcm
+from dyanon import create_query
+from pipeline import WorkflowTemplate, compute_workflow_nodes_info, transform_plugin_data, update_plugin_parameters
+
+BASELINE = Path(__file__).resolve().parent / "baseline.json"
+
+SIZES = {
+    "small": {"rows": 100, "params": 20, "series": 100},
+    "medium": {"rows": 10_000, "params": 100, "series": 1_000},
+    "large": {"rows": 100_000, "params": 500, "series": 10_000},
+}
+
+
+# --------------------------
+# Synthetic inputs
+# --------------------------
+def make_manifest(rows: int) -> pd.DataFrame:
+    return pd.DataFrame({
+        "search_PatientID": [f"{i:08d}" for i in range(rows)],
+        "search_StudyDate": ["20240101"] * rows,
+        "search_AccessionNumber": [f"A{i}" for i in range(rows)],
+        "search_SeriesDescription": ["T1"] * rows,
+        "anon_PatientName": [f"anon^{i}" for i in range(rows)],
+        "anon_PatientID": [f"X{i}" for i in range(rows)],
+    }, dtype=str)
+
+
+def make_parameters(params: int, pipings: int = 5) -> list[dict]:
+    return [{
+        "plugin_piping_id": i % pipings,
+        "previous_plugin_piping_id": (i % pipings) - 1 if i % pipings else None,
+        "plugin_piping_title": f"plugin-{i % pipings}",
+        "param_name": f"param{i}",
+        "value": None if i % 3 else f"default{i}",
+    } for i in range(params)]
+
+
+def make_items(params: int) -> list[dict]:
+    return [{"data": [{"name": k, "value": v} for k, v in d.items()]} for d in make_parameters(params)]
+
+
+def make_overrides(params: int, pipings: int = 5) -> dict:
+    return {f"plugin-{p}": {f"param{i}": f"override{i}" for i in range(p, params, pipings * 2)}
+            for p in range(pipings)}
+
+
+def make_directive(fields: int) -> dict:
+    base = {"PatientID": "1234", "PatientName": "doe", "StudyDescription": "brain", "SeriesDescription": "t1"}
+    return {**base, **{f"Tag{i}": str(i) for i in range(fields)}}
+
+
+def make_response(series: int) -> dict:
+    def one(i):
+        return {
+            "SeriesDescription": {"value": f"T1 series {i}"},
+            "PatientName": {"value": "DOE^JOHN"},
+            "SeriesInstanceUID": {"value": f"1.2.{i}"},
+            "StudyInstanceUID": {"value": f"1.3.{i // 10}"},
+            "NumberOfSeriesRelatedInstances": {"value": "100"},
+        }
+    return {"pypx": {"data": [{"series": [one(i) for i in range(j, min(j + 10, series))]}
+                              for j in range(0, series, 10)]}}
+
+
+# --------------------------
+# Benchmark cases: name -> (setup(size) -> args, function)
+# --------------------------
+CASES = {
+    "create_query": (lambda s: (make_manifest(s["rows"]),), create_query),
+    "transform_plugin_data": (lambda s: (make_items(s["params"] * 10),), transform_plugin_data),
+    "compute_workflow_nodes_info": (lambda s: (make_parameters(s["params"]), True), compute_workflow_nodes_info),
+    "update_plugin_parameters": (
+        lambda s: (compute_workflow_nodes_info(make_parameters(s["params"]), True), make_overrides(s["params"])),
+        lambda nodes_info, overrides: update_plugin_parameters(copy.deepcopy(nodes_info), overrides)),
+    "WorkflowTemplate.render": (
+        lambda s: (WorkflowTemplate(1, 5, compute_workflow_nodes_info(make_parameters(s["params"]), True)),
+                   {"plugin-0": {"param0": "directive"}, "plugin-2": {"param2": "tags"}}),
+        lambda template, row_params: template.render(row_params)),
+    "pfdcm.sanitize": (lambda s: (make_directive(s["params"]),), pfdcm.sanitize),
+    "pfdcm.autocomplete_directive": (
+        lambda s: ({"PatientName": "doe", "SeriesDescription": "t1"}, make_response(s["series"])),
+        pfdcm.autocomplete_directive),
+}
+
+
+def calibrate() -> float:
+    """
+    Best time of a fixed pure-Python workload, used as the unit of all timings.
+    """
+    def work():
+        d = {}
+        for i in range(200_000):
+            d[i % 1000] = str(i)
+        return d
+    return min(measure_time(work, (), 1) for _ in range(5))
+
+
+def measure_time(func, args: tuple, number: int) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        func(*args)
+    return (time.perf_counter() - start) / number
+
+
+def run_case(func, args: tuple, repeat: int) -> dict:
+    # pick a loop count that runs for roughly 0.2s
+    once = measure_time(func, args, 1)
+    number = max(1, min(100_000, int(0.2 / max(once, 1e-7))))
+    best = min(measure_time(func, args, number) for _ in range(repeat))
+
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": best, "peak_bytes": peak}
+
+
+def main():
+    parser = ArgumentParser(description="dyanon transformation microbenchmarks")
+    parser.add_argument("--update", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.5,
+                        help="allowed relative time regression before failing; timings are noisy on shared hosts")
+    parser.add_argument("--memThreshold", type=float, default=0.1,
+                        help="allowed relative peak memory regression before failing")
+    parser.add_argument("--memFloor", type=int, default=64 * 1024,
+                        help="peak memory growth in bytes that is never a regression; small peaks are noisy")
+    parser.add_argument("--sizes", default="small,medium,large", help="comma separated input sizes to run")
+    parser.add_argument("-k", default="", help="only run cases whose name contains this string")
+    parser.add_argument("--repeat", type=int, default=5, help="repeats per case; the best one is kept")
+    args = parser.parse_args()
+
+    unit = calibrate()
+    baseline = json.loads(BASELINE.read_text()) if BASELINE.exists() else {}
+    results = dict(baseline) if args.update else {}
+    l_regression = []
+
+    print(f"{'case':<45} {'time':>12} {'rel':>9} {'peak':>12}  baseline")
+    for name, (setup, func) in CASES.items():
+        if args.k not in name:
+            continue
+        for size in args.sizes.split(","):
+            key = f"{name}[{size}]"
+            d_result = run_case(func, setup(SIZES[size]), args.repeat)
+            d_result["relative"] = d_result.pop("seconds") / unit
+            results[key] = d_result
+
+            line = (f"{key:<45} {d_result['relative'] * unit * 1000:10.3f}ms {d_result['relative']:9.4f} "
+                    f"{d_result['peak_bytes'] / 1024:10.1f}KB")
+            if key in baseline and not args.update:
+                d_base = baseline[key]
+                ratio_time = d_result["relative"] / d_base["relative"]
+                ratio_mem = d_result["peak_bytes"] / max(d_base["peak_bytes"], 1)
+                line += f"  time x{ratio_time:.2f} mem x{ratio_mem:.2f}"
+                mem_grown = (d_result["peak_bytes"] - d_base["peak_bytes"] > args.memFloor
+                             and ratio_mem > 1 + args.memThreshold)
+                if ratio_time > 1 + args.threshold or mem_grown:
+                    l_regression.append(key)
+                    line += "  REGRESSION"
+            print(line)
+
+    if args.update:
+        BASELINE.write_text(json.dumps(results, indent=2, sort_keys=True) + "\n")
+        print(f"Baseline written to {BASELINE}")
+    elif l_regression:
+        print(f"{len(l_regression)} regression(s): {', '.join(l_regression)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
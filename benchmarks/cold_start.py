@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Cold-start benchmark for dyanon.
+
+Measures, over several fresh interpreter launches:
+
+    import       -- ``import dyanon``
+    version      -- ``dyanon.py --version``
+    first request -- time from process launch until the first HTTP request
+                     (the CUBE health check) reaches a local stub server
+
+Usage: python benchmarks/cold_start.py [-n RUNS]
+"""
+
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPO = Path(__file__).resolve().parent.parent
+
+
+class FirstRequest(BaseHTTPRequestHandler):
+    """
+    Record the arrival of the first request and fail it so that dyanon exits.
+    """
+    received = threading.Event()
+    arrival = 0.0
+
+    def do_GET(self):
+        if not FirstRequest.received.is_set():
+            FirstRequest.arrival = time.perf_counter()
+            FirstRequest.received.set()
+        try:
+            self.send_error(503)
+        except OSError:
+            # the benchmarked process may already have been killed
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+def time_command(args: list[str]) -> float:
+    start = time.perf_counter()
+    subprocess.run(args, cwd=REPO, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def time_first_request(url: str, inputdir: str, outputdir: str) -> float:
+    FirstRequest.received.clear()
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "dyanon.py", "--CUBEurl", url, "--CUBEtoken", "token",
+                             "--pluginInstanceID", "1", "--PFDCMurl", url, inputdir, outputdir],
+                            cwd=REPO, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    FirstRequest.received.wait(timeout=60)
+    elapsed = FirstRequest.arrival - start
+    proc.kill()
+    proc.wait()
+    return elapsed
+
+
+def report(name: str, l_time: list[float]):
+    print(f"{name:<14} median {statistics.median(l_time) * 1000:8.1f} ms   "
+          f"min {min(l_time) * 1000:8.1f} ms   max {max(l_time) * 1000:8.1f} ms")
+
+
+def main():
+    parser = ArgumentParser(description="dyanon cold-start benchmark")
+    parser.add_argument("-n", "--runs", type=int, default=10, help="launches per measurement")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FirstRequest)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/api/v1/"
+
+    with tempfile.TemporaryDirectory() as inputdir, tempfile.TemporaryDirectory() as outputdir:
+        report("import", [time_command([sys.executable, "-c", "import dyanon"]) for _ in range(args.runs)])
+        report("version", [time_command([sys.executable, "dyanon.py", "--version"]) for _ in range(args.runs)])
+        report("first request", [time_first_request(url, inputdir, outputdir) for _ in range(args.runs)])
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
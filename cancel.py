@@ -0,0 +1,114 @@
+from loguru import logger
+from journal import Journal
+import concurrent.futures
+import signal
+import threading
+
+LOG = logger.debug
+
+TERMINAL_STATUSES = ("finishedSuccessfully", "finishedWithError", "cancelled")
+
+
+class Canceller:
+    """
+    Cancel the in-flight workflows of the run on SIGTERM/SIGINT or when a deadline passes.
+
+    The signal handler and the deadline timer only flag the run as cancelled;
+    a second signal interrupts the process. The thread driving the run then calls
+    ``cancel_workflows``, which takes the workflows from the run's tracker, cancels
+    their unfinished plugin instances concurrently and writes the outcome to the journal.
+    """
+
+    def __init__(self, pipe, tracker, journal: Journal, workers: int = 16, event: threading.Event = None):
+        self.pipe = pipe
+        self.tracker = tracker
+        self.journal = journal
+        self.workers = workers
+        self.event = event if event is not None else threading.Event()
+        self.lock = threading.Lock()
+        self.reason = None
+        self.done = False
+        self.timer = None
+
+    def install(self, deadline: int = 0):
+        """
+        Install signal handlers and start the deadline timer, if any.
+        """
+        # signal handlers can only be installed from the main thread
+        if threading.current_thread() is threading.main_thread():
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(sig, self._on_signal)
+        if deadline > 0:
+            self.timer = threading.Timer(deadline, self.request, args=("deadline",))
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _on_signal(self, signum, frame):
+        # no locks or I/O here: the interrupted thread may be holding any of them
+        if self.event.is_set():
+            raise KeyboardInterrupt
+        self.request(signal.Signals(signum).name)
+
+    def stop(self):
+        if self.timer:
+            self.timer.cancel()
+
+    def is_set(self) -> bool:
+        return self.event.is_set()
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Sleep for up to ``timeout`` seconds, waking up early if the run is cancelled.
+        """
+        return self.event.wait(timeout)
+
+    def request(self, reason: str):
+        """
+        Flag the run as cancelled: no further jobs are submitted and monitors stop waiting.
+        """
+        if not self.event.is_set():
+            self.reason = reason
+            logger.warning(f"Cancelling the run: {reason}")
+        self.event.set()
+
+    def cancel_workflows(self):
+        """
+        Cancel every unfinished plugin instance of the run, once the run is flagged as cancelled.
+        """
+        with self.lock:
+            if not self.event.is_set() or self.done:
+                return
+            self.done = True
+        l_workflow = self.tracker.tracked()
+        logger.warning(f"Cancelling {len(l_workflow)} workflow(s): {self.reason}")
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            l_inst = [i for l_wf in executor.map(self._pending_instances, l_workflow) for i in l_wf]
+            l_outcome = list(executor.map(self._cancel_instance, l_inst))
+
+        cancelled = [inst_id for inst_id, ok in zip(l_inst, l_outcome) if ok]
+        failed = [inst_id for inst_id, ok in zip(l_inst, l_outcome) if not ok]
+        self.journal.record("cancel", reason=self.reason, workflows=l_workflow,
+                            cancelled_instances=cancelled, failed_instances=failed)
+        logger.warning(f"Cancelled {len(cancelled)} plugin instance(s), {len(failed)} could not be cancelled")
+
+    def _pending_instances(self, workflow_id: int) -> list[int]:
+        try:
+            response = self.pipe.make_request("GET", f"/pipelines/workflows/{workflow_id}/plugininstances/")
+        except Exception as ex:
+            LOG(f"Could not list plugin instances of workflow {workflow_id}: {ex}")
+            return []
+        l_inst = []
+        for item in response:
+            d_inst = {field.get("name"): field.get("value") for field in item.get("data", [])}
+            if d_inst.get("id") is not None and d_inst.get("status") not in TERMINAL_STATUSES:
+                l_inst.append(d_inst["id"])
+        return l_inst
+
+    def _cancel_instance(self, inst_id: int) -> bool:
+        try:
+            self.pipe.make_request("PUT", f"/plugins/instances/{inst_id}/", json={"status": "cancelled"})
+            return True
+        except Exception as ex:
+            LOG(f"Could not cancel plugin instance {inst_id}: {ex}")
+            return False
@@ -1,34 +1,30 @@
 ### Python Chris Client Implementation ###
 
 from base_client import BaseClient
-import json
 import requests
 from loguru import logger
-import sys
-from pipeline import Pipeline
+from pipeline import Pipeline, SubmittedWorkflows, TemplateCache, idempotency_key
 LOG = logger.debug
 
-logger_format = (
-    "<green>{time:YYYY-MM-DD HH:mm:ss}</green> │ "
-    "<level>{level: <5}</level> │ "
-    "<yellow>{name: >28}</yellow>::"
-    "<cyan>{function: <30}</cyan> @"
-    "<cyan>{line: <4}</cyan> ║ "
-    "<level>{message}</level>"
-)
-logger.remove()
-logger.add(sys.stderr, format=logger_format)
 
 class ChrisClient(BaseClient):
-    def __init__(self, url: str, token: str):
+    def __init__(self, url: str, token: str, notifier=None, tracker=None, history=None, cancel_event=None):
         self.api_base = url.rstrip('/')
         self.auth = token
+        self.notifier = notifier
+        self.tracker = tracker
+        self.history = history
+        self.cancel_event = cancel_event
+        self.templates = TemplateCache()
+        self.workflows = SubmittedWorkflows()
+        self.session = requests.Session()
+        self.session.mount(self.api_base, requests.adapters.HTTPAdapter(pool_maxsize=32))
         self.headers = {"Content-Type": "application/json", "Authorization": f"Token {token}"}
         self.pacs_series_url = f"{url}/pacs/series/"
 
     def health_check(self):
         endpoint = f"{self.api_base}/"
-        response = requests.request("GET", endpoint, headers=self.headers, timeout=30)
+        response = self.session.request("GET", endpoint, headers=self.headers, timeout=30)
 
         response.raise_for_status()
 
@@ -41,39 +37,40 @@ class ChrisClient(BaseClient):
         pass
     def pacs_push(self):
         pass
-    async def anonymize(self, params: dict, pv_id: int):
-        pipe = Pipeline(self.api_base, self.auth)
-        plugin_params = {
-            'PACS-query': {
-                "PACSurl": params["pull"]["url"],
-                "PACSname": params["pull"]["pacs"],
-                "PACSdirective": json.dumps(params["search"])
-            },
-            'PACS-retrieve': {
-                "PACSurl": params["pull"]["url"],
-                "PACSname": params["pull"]["pacs"],
-                "inputJSONfile": "search_results.json",
-                "copyInputFile": True
-            },
-            'verify-registration': {
-                "CUBEurl": self.api_base,
-                "inputJSONfile": "search_results.json",
-                "tagStruct": json.dumps(params["anon"]),
-                "orthancUrl": params["push"]["url"],
-                "orthancUsername": params["push"]["username"],
-                "orthancPassword": params["push"]["password"],
-                "PFDCMurl": params["pull"]["url"],
-                "PACSname": params["pull"]["pacs"],
-                "pushToRemote": params["push"]["aec"],
-                "SMTPServer": params["notify"]["smtp_server"],
-                "recipients": params["notify"]["recipients"],
-                "preserveTags": params["preserve"]["preserveTags"],
-                "imgCount": params["filter"]["imgCount"],
-                "dicomFilter": params["filter"]["dicomFilter"]
-            }
-        }
-        d_ret = await pipe.run_pipeline(
-            previous_inst=pv_id,
-            pipeline_name=params["pipeline"]["name"],
-            pipeline_params=plugin_params)
+    def _pipeline(self) -> Pipeline:
+        return Pipeline(self.api_base, self.auth, self.notifier, self.tracker, self.history, self.templates,
+                        self.session, self.workflows, self.cancel_event)
+
+    def compile(self, job, config) -> dict:
+        """
+        Render the workflow of a job; rows sharing a retrieve with another profile only run the anonymization branch.
+        """
+        pipeline_name = config.branch_pipeline_name if job.branch_from else config.pipeline_name
+        return self._pipeline().compile_workflow(pipeline_name, config.params_template, config.row_params(job))
+
+    def submit(self, job, pv_id: int, compiled: dict) -> dict:
+        """
+        Post a compiled job, reporting its retrieve node if other rows branch from it.
+        A job already submitted under ``pv_id`` by an earlier attempt or run is not posted again.
+        """
+        pipe = self._pipeline()
+        previous = job.branch_from or pv_id
+        d_ret = pipe.submit_workflow(compiled, previous, pv_id, idempotency_key(job.id, previous, compiled))
+        if job.share_retrieve and d_ret.get("workflow_id") is not None:
+            try:
+                d_ret["retrieve_node_id"] = pipe.get_workflow_node(d_ret["workflow_id"], "PACS-retrieve")
+            except Exception as ex:
+                LOG(f"Could not find the retrieve node of workflow {d_ret['workflow_id']}: {ex}")
         return d_ret
+
+    async def monitor(self, job, pv_id: int, compiled: dict, submitted: dict) -> dict:
+        return await self._pipeline().await_workflow(compiled, submitted, job.branch_from or pv_id, job.cost)
+
+    async def anonymize(self, job, pv_id: int, config):
+        try:
+            compiled = self.compile(job, config)
+            submitted = self.submit(job, pv_id, compiled)
+            return await self.monitor(job, pv_id, compiled, submitted)
+        except Exception as ex:
+            logger.error(f"Running pipeline failed due to: {ex}")
+            return {"status": "Failed", "error": str(ex)}
@@ -1,24 +1,12 @@
 import requests
-from chrisclient import request
 from loguru import logger
-import sys
+from profiler import stage
 from requests.exceptions import RequestException, Timeout, HTTPError
 from tenacity import retry, wait_exponential, stop_after_attempt, retry_if_exception_type
 from urllib.parse import urlencode
 
 LOG = logger.debug
 
-logger_format = (
-    "<green>{time:YYYY-MM-DD HH:mm:ss}</green> │ "
-    "<level>{level: <5}</level> │ "
-    "<yellow>{name: >28}</yellow>::"
-    "<cyan>{function: <30}</cyan> @"
-    "<cyan>{line: <4}</cyan> ║ "
-    "<level>{message}</level>"
-)
-logger.remove()
-logger.add(sys.stderr, format=logger_format)
-
 
 class PACSClient(object):
     def __init__(self, url: str, token: str):
@@ -37,7 +25,9 @@ class PACSClient(object):
         reraise=True
     )
     def make_request(self, method, endpoint, **kwargs):
-        response = requests.request(method, endpoint, headers=self.headers, auth=self.auth, timeout=30, **kwargs)
+        with stage("http_wait"):
+            response = requests.request(method, endpoint, headers=self.headers, auth=self.auth, timeout=30,
+                                        **kwargs)
         response.raise_for_status()
 
         try:
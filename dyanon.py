@@ -2,34 +2,37 @@
 
 from pathlib import Path
 from argparse import ArgumentParser, Namespace, ArgumentDefaultsHelpFormatter
+from typing import TYPE_CHECKING
 from loguru import logger
 from chris_plugin import chris_plugin, PathMapper
-from pipeline import Pipeline
-from runnable import Runnable
-import pandas as pd
+from log_config import setup_logging
+from job import JobRecord, RunConfig
+from scheduler import JobScheduler, POLICIES
+from profiler import stage
+import profiler
+import shard
 import json
-import itertools
 from collections import ChainMap
-from chrisClient import ChrisClient
-import pfdcm
-import sys
-import time
+from dataclasses import dataclass
 import os
-import concurrent.futures
-import asyncio
-import requests
+
+# Heavy dependencies (pandas, requests and the CUBE clients built on it) are
+# imported on first use so that --version, --help and chris_plugin_info stay fast.
+if TYPE_CHECKING:
+    import pandas as pd
+    from chrisClient import ChrisClient
+    from fanin import FanIn
+    from notification import NotificationAggregator
+    from admission import AdmissionController
+    from progress import ProgressReporter
+    from cancel import Canceller
+    from routing import PacsRouter
+
 LOG = logger.debug
+ROW_LOG = logger.bind(row_event=True).debug
 
-logger_format = (
-    "<green>{time:YYYY-MM-DD HH:mm:ss}</green> │ "
-    "<level>{level: <5}</level> │ "
-    "<yellow>{name: >28}</yellow>::"
-    "<cyan>{function: <30}</cyan> @"
-    "<cyan>{line: <4}</cyan> ║ "
-    "<level>{message}</level>"
-)
-logger.remove()
-logger.add(sys.stderr, format=logger_format)
+# optional manifest columns (case-insensitive) and the job attribute they set
+HINT_COLUMNS = {"priority": "priority", "cost": "cost", "pacsname": "pacs", "pfdcmurl": "pfdcm"}
 
 __version__ = '1.1.7'
 
@@ -59,6 +62,50 @@ parser.add_argument(
             pattern for file names to include.
             Default is **/*csv.""",
 )
+parser.add_argument(
+    "--schedule",
+    default="fifo",
+    choices=POLICIES,
+    help="order in which rows are dispatched: manifest order, highest priority column first or shortest job first",
+)
+parser.add_argument(
+    "--aging",
+    default=0.0,
+    type=float,
+    help="priority/cost units per second by which waiting rows are promoted",
+)
+parser.add_argument(
+    "--costPreQuery",
+    help="estimate the cost of rows without a cost column by querying the PACS for their image count",
+    dest="costPreQuery",
+    action="store_true",
+    default=False,
+)
+parser.add_argument(
+    "--shard",
+    default="",
+    type=str,
+    help="process only the i-th of N deterministic partitions of the manifest, given as i/N",
+)
+parser.add_argument(
+    "--mergeShards",
+    help="merge the shard manifests found in the input directory and run the reduce phase on them",
+    dest="mergeShards",
+    action="store_true",
+    default=False,
+)
+parser.add_argument(
+    "--watch",
+    default=0,
+    type=float,
+    help="keep running and poll the input directory for new manifests every this many seconds; 0 processes the input once"
+)
+parser.add_argument(
+    "--watchQueue",
+    default="",
+    type=str,
+    help="file in the input directory to which manifest paths are appended, one per line, while watching"
+)
 parser.add_argument(
     "--pluginInstanceID",
     default="",
@@ -75,11 +122,140 @@ parser.add_argument(
     help="CUBE/ChRIS user token"
 )
 
+parser.add_argument(
+    "--logLevel",
+    default="DEBUG",
+    type=str,
+    help="minimum level of log messages"
+)
+parser.add_argument(
+    "--logLevels",
+    default="",
+    type=str,
+    help="comma separated per-module log levels, e.g. pfdcm=INFO,pipeline=WARNING"
+)
+parser.add_argument(
+    "--logFormat",
+    default="text",
+    choices=("text", "json"),
+    help="write human readable log lines or structured JSON lines"
+)
+parser.add_argument(
+    "--logSample",
+    default=1,
+    type=int,
+    help="keep only one in this many per-row debug messages"
+)
+parser.add_argument(
+    "--asyncLog",
+    help="write logs from a background thread instead of the calling worker",
+    dest="asyncLog",
+    action="store_true",
+    default=False,
+)
+parser.add_argument(
+    "--profile",
+    help="sample the run and write profile.collapsed and a per-stage profile-summary.json to the output directory",
+    dest="profile",
+    action="store_true",
+    default=False,
+)
+parser.add_argument(
+    "--profileInterval",
+    default=0.01,
+    type=float,
+    help="seconds between two profiler samples"
+)
 parser.add_argument(
     "--maxThreads",
     default=4,
     help="max number of parallel threads"
 )
+parser.add_argument(
+    "--compileThreads",
+    default=1,
+    type=int,
+    help="number of threads rendering the workflows of rows ahead of submission"
+)
+parser.add_argument(
+    "--submitThreads",
+    default=0,
+    type=int,
+    help="number of threads posting workflows to CUBE; defaults to --maxThreads"
+)
+parser.add_argument(
+    "--stageQueue",
+    default=0,
+    type=int,
+    help="max number of rows waiting between two pipeline stages; defaults to twice --maxThreads"
+)
+parser.add_argument(
+    "--pacsThreads",
+    default=0,
+    type=int,
+    help="max number of rows in flight per PACS; defaults to --maxThreads"
+)
+parser.add_argument(
+    "--pacsRate",
+    default=0.0,
+    type=float,
+    help="max number of rows submitted per minute to each PACS; 0 disables rate limiting"
+)
+parser.add_argument(
+    "--pacsFailures",
+    default=5,
+    type=int,
+    help="consecutive failed rows after which a PACS is paused; 0 disables the circuit breaker"
+)
+parser.add_argument(
+    "--pacsCooldown",
+    default=300,
+    type=int,
+    help="seconds a paused PACS waits before a single row is tried again"
+)
+parser.add_argument(
+    "--windows",
+    default="",
+    type=str,
+    help="comma separated local time windows in which rows may be submitted, e.g. 'Mon-Fri 19:00-07:00,Sat-Sun 00:00-24:00'"
+)
+parser.add_argument(
+    "--studiesPerHour",
+    default=0,
+    type=int,
+    help="max number of rows submitted to each PACS within any hour; 0 disables the quota"
+)
+parser.add_argument(
+    "--imagesPerHour",
+    default=0,
+    type=int,
+    help="max number of expected images (cost) submitted to each PACS within any hour; 0 disables the quota"
+)
+parser.add_argument(
+    "--highWater",
+    default=0,
+    type=int,
+    help="hold new submissions while this many jobs of the run are active in CUBE; 0 disables admission control"
+)
+parser.add_argument(
+    "--lowWater",
+    default=0,
+    type=int,
+    help="resume submissions once the active jobs drop to this many; defaults to half of --highWater"
+)
+parser.add_argument(
+    "--deadline",
+    default=0,
+    type=int,
+    help="seconds after which the run stops submitting and cancels its in-flight workflows; 0 disables the deadline"
+)
+parser.add_argument(
+    "--durationHistory",
+    default="",
+    type=str,
+    help="JSON file of workflow durations used for ETAs and monitor polling, updated across runs; point it at "
+         "persistent storage. Defaults to $XDG_CACHE_HOME/pl-dyanon/duration_history.json (~/.cache if unset)"
+)
 parser.add_argument(
     '--orthancUrl',
     help='Orthanc server url. Please include api version in the url endpoint.',
@@ -141,6 +317,12 @@ parser.add_argument(
     type=str,
     help='valid email server'
 )
+parser.add_argument(
+    '--notifyWindow',
+    default=0,
+    type=int,
+    help='seconds over which failures are collected into one notification; 0 sends a single digest at the end of the run'
+)
 parser.add_argument(
     '--preserveTags',
     default='',
@@ -165,6 +347,31 @@ parser.add_argument(
     type=str,
     help='Name of the pipeline to run in the analysis'
 )
+parser.add_argument(
+    '--branchPipelineName',
+    default='',
+    type=str,
+    help='Name of an anonymization-only pipeline; rows repeating a search with other anon tags branch it from the shared PACS retrieve'
+)
+parser.add_argument(
+    '--requiredSearchKeys',
+    default='',
+    type=str,
+    help='comma separated search keys that every manifest row must provide, e.g. PatientID,StudyDate'
+)
+parser.add_argument(
+    '--resultsParquet',
+    help='also write the per-row results table as Parquet (requires pyarrow)',
+    dest='resultsParquet',
+    action='store_true',
+    default=False,
+)
+parser.add_argument(
+    '--resultsBatch',
+    default=1000,
+    type=int,
+    help='number of rows per Parquet row group'
+)
 parser.add_argument(
     '--reducePipelineName',
     default='',
@@ -177,6 +384,12 @@ parser.add_argument(
     type=str,
     help='Filter the output on file type before joining'
 )
+parser.add_argument(
+    '--reduceGroupSize',
+    default=32,
+    type=int,
+    help='number of plugin instances joined by a single topological copy'
+)
 # The main function of this *ChRIS* plugin is denoted by this ``@chris_plugin`` "decorator."
 # Some metadata about the plugin is specified here. There is more metadata specified in setup.py.
 #
@@ -203,92 +416,497 @@ def main(options: Namespace, inputdir: Path, outputdir: Path):
     print(DISPLAY_TITLE)
 
     log_file = os.path.join(options.outputdir, 'terminal.log')
-    logger.add(log_file)
+    setup_logging(log_file, options.logLevel, options.logFormat, options.asyncLog, options.logLevels, options.logSample)
     LOG(f"Logs are stored in {log_file}")
 
     if not health_check(options): return
-    cube_con = ChrisClient(options.CUBEurl, options.CUBEtoken)
+    from chrisClient import ChrisClient
+    from pipeline import Pipeline
+    from runnable import Runnable
+    from notification import NotificationAggregator
+    from admission import AdmissionController
+    from progress import DurationHistory, ProgressReporter, default_history_path
+    from journal import Journal
+    from cancel import Canceller
+    from routing import PacsRouter
+    from policy import SubmissionWindows
+    import threading
+
+    history = DurationHistory(options.durationHistory or default_history_path())
+    router = PacsRouter(options.PACSname, options.pacsThreads or int(options.maxThreads), options.pacsRate,
+                        options.pacsFailures, options.pacsCooldown, SubmissionWindows(options.windows),
+                        options.studiesPerHour, options.imagesPerHour)
+    progress = ProgressReporter(outputdir / 'progress.json', history, options.pipelineName,
+                                int(options.maxThreads) if int(options.thread) else 1, router=router)
+    notifier = NotificationAggregator(Runnable(options.CUBEurl, options.CUBEtoken), options.notifyWindow)
+    # held submissions are released as soon as the run is cancelled
+    cancel_event = threading.Event()
+    admission = AdmissionController(Pipeline(options.CUBEurl, options.CUBEtoken), options.highWater, options.lowWater,
+                                    cancel_event=cancel_event)
+    journal = Journal(outputdir / 'journal.jsonl')
+    canceller = Canceller(Pipeline(options.CUBEurl, options.CUBEtoken), admission, journal, event=cancel_event)
+    canceller.install(options.deadline)
+    cube_con = ChrisClient(options.CUBEurl, options.CUBEtoken, notifier, admission, history, canceller.event)
+    config = RunConfig.from_options(options)
+
+    if options.profile:
+        profiler.start(options.profileInterval)
+
+    if options.mergeShards:
+        merge_shards(options, cube_con, inputdir, outputdir)
+        profiler.finish(outputdir)
+        return
+
+    ctx = RunContext(config, cube_con, notifier, admission, progress, canceller, router)
+    shard_index, shard_count = shard.parse_shard(options.shard) if options.shard else (0, 1)
+    l_result = []
+
+    if options.watch:
+        watch_manifests(options, ctx, inputdir, outputdir, l_result)
+    else:
+        mapper = PathMapper.file_mapper(inputdir, outputdir, glob=options.pattern)
+        for input_file, output_file in mapper:
+            l_result += process_manifest(options, ctx, input_file, output_file)
+            if canceller.is_set():
+                break
+
+    if options.shard:
+        shard.write_manifest(outputdir / shard.manifest_name(shard_index, shard_count),
+                             shard_index, shard_count, l_result)
+
+    # a cancellation flagged after the last dispatch still reaches the workflows in flight
+    canceller.cancel_workflows()
+    canceller.stop()
+    progress.write(force=True)
+    profiler.finish(outputdir)
+    # drain queued log messages
+    logger.complete()
+
+
+@dataclass
+class RunContext:
+    """
+    Clients and run-wide state shared by every manifest processed by this process.
+    """
+    config: RunConfig
+    cube_con: 'ChrisClient'
+    notifier: 'NotificationAggregator'
+    admission: 'AdmissionController'
+    progress: 'ProgressReporter'
+    canceller: 'Canceller'
+    router: 'PacsRouter'
+
 
-    mapper = PathMapper.file_mapper(inputdir, outputdir, glob=options.pattern)
-    for input_file, output_file in mapper:
-        LOG(f"Reading input from {input_file}")
+def process_manifest(options: Namespace, ctx: RunContext, input_file: Path, output_file: Path) -> list[dict]:
+    """
+    Validate a manifest, run its rows and the reduce phase, and stream their results
+    next to ``output_file``. Returns the result of every dispatched row.
+    """
+    import pandas as pd
+    from runnable import Runnable
+    from fanin import FanIn
+    from results import ResultsWriter
+    from validate import validate_manifest
+
+    LOG(f"Reading input from {input_file}")
+    with stage("csv_load"):
         df = pd.read_csv(input_file, dtype=str)
+        # reject malformed rows before any of them consumes PACS or CUBE capacity
+        try:
+            df, df_rejected = validate_manifest(df, [k.strip() for k in options.requiredSearchKeys.split(',')
+                                                     if k.strip()])
+        except ValueError as ex:
+            logger.error(f"Skipping invalid manifest {input_file}: {ex}")
+            return []
+    if not df_rejected.empty:
+        rejected_file = output_file.with_name(f"{output_file.stem}.rejected.csv")
+        df_rejected.to_csv(rejected_file, index_label="row")
+        logger.warning(f"Rejected rows of {input_file} are listed in {rejected_file}")
+    with stage("create_query"):
         l_job = create_query(df)
-        l_leaf_node_ids = []
-        # Fan-out logic on input space -> Map
-        if int(options.thread):
-            with concurrent.futures.ThreadPoolExecutor(max_workers=int(options.maxThreads)) as executor:
-                results: Iterator = executor.map(lambda t: register_and_anonymize(options, t, cube_con, options.wait), l_job)
-
-            # Wait for all tasks to complete
-            # executor.shutdown(wait=True)
-        else:
-            for d_job in l_job:
-                response = asyncio.run(register_and_anonymize(options, d_job, cube_con))
-                LOG(response)
-                if response.get("leaf_node_id") is not None:
-                    l_leaf_node_ids.append(response["leaf_node_id"])
+        if options.shard:
+            l_job = shard.select_shard(l_job, *shard.parse_shard(options.shard))
+        row_count = len(l_job)
+        d_branch = {}
+        if options.branchPipelineName:
+            l_job, d_branch = share_retrieves(l_job)
+    fan_in = None
+    # the reduce phase of a sharded run happens once, after merging
+    if options.reducePipelineName and not options.shard:
+        fan_in = FanIn(Runnable(options.CUBEurl, options.CUBEtoken), options.reduceGroupSize, options.reduceFilter)
+
+    l_result = []
+    writer = ResultsWriter(output_file, list(dict.fromkeys(k for job in l_job for k in job.search)),
+                           options.resultsParquet, options.resultsBatch)
+
+    def collect(job: JobRecord, response: dict):
+        ROW_LOG(response)
+        ctx.progress.finished(response.get("status") != "Failed")
+        writer.add(job, response)
+        l_result.append({
+            "search": job.search,
+            "status": response.get("status"),
+            "leaf_node_id": response.get("leaf_node_id"),
+            "error": response.get("error")
+        })
+        if fan_in and response.get("leaf_node_id") is not None:
+            fan_in.add(response["leaf_node_id"])
+        if l_follower := d_branch.pop(job.id, []):
+            # a failed workflow's retrieve can't be branched from
+            retrieve_id = response.get("retrieve_node_id") if response.get("status") != "Failed" else None
+            branch(job, retrieve_id, l_follower)
+
+    def branch(job: JobRecord, retrieve_id, l_follower: list[JobRecord]):
+        for follower in l_follower:
+            follower.cost = follower.cost or job.cost
+        if retrieve_id is None:
+            # the shared retrieve failed; the next profile retries it for the rest of the group
+            first, l_follower = l_follower[0], l_follower[1:]
+            first.share_retrieve = bool(l_follower)
+            if l_follower:
+                d_branch[first.id] = l_follower
+            scheduler.push(first)
+            return
+        for follower in l_follower:
+            follower.branch_from = retrieve_id
+            scheduler.push(follower)
+
+    if options.costPreQuery:
+        estimate_costs(options, l_job)
+    scheduler = JobScheduler(options.schedule, options.aging)
+    scheduler.extend(l_job)
+    ctx.progress.add_queued(row_count)
+
+    # Fan-out logic on input space -> Map
+    try:
+        dispatch(options, ctx.config, ctx.cube_con, scheduler, collect, ctx.admission, ctx.progress,
+                 ctx.canceller, ctx.router)
+    finally:
+        writer.close()
 
-        # Fan-in logic on output space -> Reduce
-        if l_leaf_node_ids and options.reducePipelineName:
-            join_results(options, cube_con, l_leaf_node_ids)
+    # Fan-in logic on output space -> Reduce
+    if fan_in and not ctx.canceller.is_set():
+        join_results(options, ctx.cube_con, fan_in)
 
+    # Send a digest of any failures collected for this input file
+    ctx.notifier.flush()
+    return l_result
 
 
-if __name__ == '__main__':
-    main()
+def watch_manifests(options: Namespace, ctx: RunContext, inputdir: Path, outputdir: Path, l_result: list[dict]):
+    """
+    Daemon mode: keep the clients and their caches warm and process every new
+    manifest found in the input directory or the queue file, until the run is cancelled.
+    """
+    from watch import ManifestWatcher
+
+    watcher = ManifestWatcher(inputdir, options.pattern, outputdir / 'watch-state.json', options.watchQueue)
+    logger.info(f"Watching {inputdir} for new manifests every {options.watch}s")
+    while not ctx.canceller.is_set():
+        l_new = watcher.poll()
+        for input_file in l_new:
+            try:
+                output_file = outputdir / input_file.relative_to(inputdir)
+            except ValueError:
+                output_file = outputdir / input_file.name
+            output_file.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                l_result += process_manifest(options, ctx, input_file, output_file)
+            except Exception as ex:
+                logger.error(f"Processing manifest {input_file} failed: {ex}")
+            if ctx.canceller.is_set():
+                return
+            watcher.mark_done(input_file)
+        if not l_new:
+            # while idle, forget drained workflows so that a shutdown only cancels those still running
+            ctx.admission.active_jobs()
+        ctx.canceller.wait(options.watch)
+
+
+def join_results(options, cube_con: 'ChrisClient', fan_in: 'FanIn'):
+    """
+    Flush the remaining topological copies and run the reduce pipeline on the root
+    """
+    import asyncio
+    from pipeline import Pipeline
 
-def join_results(options, cube_con: ChrisClient, inst_ids: list):
-    logger.info(f"Joining plugin instances: {inst_ids}")
-    run_obj = Runnable(options.CUBEurl, options.CUBEtoken)
-    str_instances = ",".join(map(str,inst_ids))
-    filters = []
-    for inst_id in inst_ids:
-        filters.append(f"{options.reduceFilter}")
-    str_filters = ",".join(filters)
     try:
-        topo_id = run_obj.run_plugin(inst_ids[0],"pl-topologicalcopy",{
-            "plugininstances":str_instances,
-            "filter":str_filters,
-        })
-        pipe_obj = Pipeline(cube_con.api_base, cube_con.auth)
-        asyncio.run(pipe_obj.run_pipeline(options.reducePipelineName,topo_id,{}))
+        with stage("reduce"):
+            topo_id = fan_in.finalize()
+            if topo_id is None:
+                logger.error("No plugin instances available to join")
+                return
+            logger.info(f"Running reduce pipeline on plugin instance: {topo_id}")
+            pipe_obj = Pipeline(cube_con.api_base, cube_con.auth)
+            asyncio.run(pipe_obj.run_pipeline(options.reducePipelineName,topo_id,{}))
     except Exception as ex:
         logger.error(f"Error occurred which running topological copy : {ex}")
 
 
-async def register_and_anonymize(options: Namespace, d_job: dict,cube_con, wait: bool = False):
+def merge_shards(options: Namespace, cube_con: 'ChrisClient', inputdir: Path, outputdir: Path):
+    """
+    Combine the manifests written by sharded runs and run a single reduce phase
+    over the leaf nodes of all shards
+    """
+    from runnable import Runnable
+    from fanin import FanIn
+
+    l_file = sorted(inputdir.glob("**/shard-*-of-*.json"))
+    LOG(f"Merging shard manifests: {[str(f) for f in l_file]}")
+    d_merged = shard.merge_manifests(l_file)
+    (outputdir / "merged-shards.json").write_text(json.dumps(d_merged, indent=2, default=str))
+
+    if d_merged["leaf_node_ids"] and options.reducePipelineName:
+        fan_in = FanIn(Runnable(options.CUBEurl, options.CUBEtoken), options.reduceGroupSize, options.reduceFilter)
+        for inst_id in d_merged["leaf_node_ids"]:
+            fan_in.add(inst_id)
+        join_results(options, cube_con, fan_in)
+
+
+def dispatch(options: Namespace, config: RunConfig, cube_con: 'ChrisClient', scheduler: JobScheduler, collect,
+             admission: 'AdmissionController' = None, progress: 'ProgressReporter' = None,
+             canceller: 'Canceller' = None, router: 'PacsRouter' = None):
+    """
+    Pop jobs from the scheduler and run them in the order of the scheduler.
+
+    Every PACS has its own pool of at most `pacsThreads` workers, rate limit and
+    circuit breaker, and may be restricted to submission windows and an hourly
+    quota of studies and images. A job whose PACS can't take it yet is held back
+    while jobs for other archives keep flowing; held jobs go first once their
+    PACS frees up. Rows in flight keep being collected while a PACS is paused.
+    Each submission is first admitted by the admission controller, if any.
+    Once the run is cancelled no further jobs are submitted and the workflows in flight are cancelled.
+
+    With threads, rows flow through the stages compile -> pre-check -> submit ->
+    monitor -> reduce, each with its own workers, connected by bounded queues:
+    the next rows are rendered and posted while earlier ones are monitored, and
+    a stage that falls behind holds back the ones feeding it. Monitoring has a
+    pool per PACS.
+    """
+    import asyncio
+    import queue
+    import threading
+    import time
+    from collections import deque
+    from routing import PacsRouter
+    from stages import Stage
+
+    if router is None:
+        router = PacsRouter(config.pacs_name, int(options.maxThreads))
+
+    def cancelled() -> bool:
+        return canceller is not None and canceller.is_set()
+
+    def pause(seconds: float):
+        if canceller is not None:
+            canceller.wait(seconds)
+        else:
+            time.sleep(seconds)
+
+    def images(job: JobRecord) -> float | None:
+        # branches of a shared retrieve don't load the PACS
+        if job.branch_from:
+            return None
+        try:
+            return float(job.cost)
+        except (TypeError, ValueError):
+            return 0.0
+
+    def run(job: JobRecord) -> dict:
+        return asyncio.run(register_and_anonymize(options, config, job, cube_con))
+
+    dispatch_start = time.monotonic()
+    wake = threading.Event()
+
+    def finish(job: JobRecord, response: dict, start: float):
+        run_seconds = time.monotonic() - start
+        router.lane(job).release(response.get("status") != "Failed", run_seconds)
+        wake.set()
+        collect(job, {**response, "wait_seconds": round(start - dispatch_start, 3),
+                      "run_seconds": round(run_seconds, 3)})
+
+    if not int(options.thread):
+        while not cancelled() and (job := scheduler.pop()) is not None:
+            lane = router.lane(job)
+            while not cancelled() and not lane.acquire(images(job)):
+                pause(lane.ready_in(images(job)))
+            if admission: admission.wait()
+            if cancelled():
+                break
+            if progress: progress.submitted()
+            start = time.monotonic()
+            finish(job, run(job), start)
+        if cancelled():
+            canceller.cancel_workflows()
+        return
+
+    pv_id = options.pluginInstanceID
+    stage_queue = options.stageQueue or 2 * int(options.maxThreads)
+    pending = 0
+    settled = threading.Condition()
+    monitors: dict[str, Stage] = {}
+    monitors_lock = threading.Lock()
+
+    def settle():
+        nonlocal pending
+        with settled:
+            pending -= 1
+            settled.notify_all()
+
+    def failed(item, ex: Exception):
+        # stage items are a job until it is admitted, then tuples ending with its start time
+        job, start = (item, None) if isinstance(item, JobRecord) else (item[0], item[-1])
+        logger.error(f"Running pipeline failed due to: {ex}")
+        if start is None and progress:
+            progress.submitted()
+        reduce_stage.put((job, {"status": "Failed", "error": str(ex)}, start))
+
+    def compile_job(job: JobRecord):
+        with logger.contextualize(job_id=job.id):
+            ROW_LOG(job)
+            precheck_stage.put((job, cube_con.compile(job, config)))
+        wake.set()
+
+    def admit(job: JobRecord, compiled: dict):
+        if admission: admission.wait()
+        if cancelled():
+            settle()
+            return
+        if progress: progress.submitted()
+        submit_stage.put((job, compiled, time.monotonic()))
+
+    def precheck(stage: Stage):
+        # a job whose PACS can't take it yet is held back; jobs of a PACS never overtake its held jobs
+        held: dict[str, deque] = {}
+        stopping = False
+        while True:
+            wake.clear()
+            for name, l_held in held.items():
+                while l_held and (cancelled() or router.lanes[name].acquire(images(l_held[0][0]))):
+                    admit(*l_held.popleft())
+            l_wait = [router.lanes[name].ready_in(images(l_held[0][0])) for name, l_held in held.items() if l_held]
+            if stopping and not l_wait:
+                return
+            item = None
+            if not l_wait:
+                item = stage.get()
+            elif not stopping and all(len(l_held) <= stage_queue for l_held in held.values()):
+                # held rows count against the queue bound of their PACS so that backpressure reaches
+                # the compile stage without one busy archive blocking the rows of the others
+                try:
+                    item = stage.get(timeout=0)
+                except queue.Empty:
+                    pass
+            if item is None:
+                # woken up by a finished row or a newly compiled one
+                wake.wait(min(min(l_wait), 1.0))
+                continue
+            if Stage.is_stop(item):
+                stopping = True
+                continue
+            job, compiled = item
+            lane = router.lane(job)
+            if cancelled() or (not held.get(lane.name) and lane.acquire(images(job))):
+                admit(job, compiled)
+            else:
+                held.setdefault(lane.name, deque()).append(item)
+
+    def submit_job(item: tuple):
+        job, compiled, start = item
+        if cancelled():
+            reduce_stage.put((job, {"status": "Failed", "error": "run cancelled before submission"}, start))
+            return
+        with logger.contextualize(job_id=job.id):
+            submitted = cube_con.submit(job, pv_id, compiled)
+        monitor_stage(job).put((job, compiled, submitted, start))
+
+    def monitor_stage(job: JobRecord) -> Stage:
+        # rows are monitored by a pool of their PACS, so a slow archive only ties up its own workers
+        lane = router.lane(job)
+        with monitors_lock:
+            if lane.name not in monitors:
+                monitors[lane.name] = Stage(f"monitor-{lane.name}", lane.concurrency, monitor_job, failed)
+            return monitors[lane.name]
+
+    def monitor_job(item: tuple):
+        job, compiled, submitted, start = item
+        with logger.contextualize(job_id=job.id):
+            response = asyncio.run(cube_con.monitor(job, pv_id, compiled, submitted))
+        reduce_stage.put((job, response, start))
+
+    def reduce_job(item: tuple):
+        job, response, start = item
+        try:
+            with logger.contextualize(job_id=job.id):
+                if start is None:
+                    collect(job, {**response, "wait_seconds": None, "run_seconds": None})
+                else:
+                    finish(job, response, start)
+        finally:
+            settle()
+
+    reduce_stage = Stage("reduce", 1, reduce_job)
+    submit_stage = Stage("submit", options.submitThreads or int(options.maxThreads), submit_job, failed,
+                         stage_queue)
+    precheck_stage = Stage("precheck", 1, maxsize=stage_queue, target=precheck)
+    compile_stage = Stage("compile", options.compileThreads, compile_job, failed, stage_queue)
+    try:
+        while not cancelled():
+            if (job := scheduler.pop()) is None:
+                with settled:
+                    # finished rows may push follow-up rows; the run is done once none are pending
+                    if pending:
+                        settled.wait(timeout=1)
+                        continue
+                if (job := scheduler.pop()) is None:
+                    break
+            with settled:
+                pending += 1
+            compile_stage.put(job)
+    finally:
+        compile_stage.close()
+        precheck_stage.close()
+        submit_stage.close()
+        # every workflow of the run is posted by now; in-flight monitors wake up on the cancellation
+        if cancelled():
+            canceller.cancel_workflows()
+        with monitors_lock:
+            l_monitor = list(monitors.values())
+        for stage in l_monitor:
+            stage.close()
+        reduce_stage.close()
+
+
+def estimate_costs(options: Namespace, l_job: list[JobRecord]):
+    """
+    Use the expected image count from a PACS status query as the cost of rows
+    that don't provide one in the manifest
+    """
+    import pfdcm
+
+    d_route = {}
+    for job in l_job:
+        if not job.cost:
+            d_route.setdefault((job.pfdcm or options.PFDCMurl, job.pacs or options.PACSname), []).append(job)
+    for (pfdcm_url, pacs_name), l_pending in d_route.items():
+        l_response = pfdcm.query_coalesced([job.search for job in l_pending], pfdcm_url, pacs_name)
+        for job, d_response in zip(l_pending, l_response):
+            if not d_response:
+                continue
+            try:
+                _, job.cost = pfdcm.autocomplete_directive(job.search, d_response)
+            except Exception as ex:
+                LOG(f"Could not estimate cost for {job.search}: {ex}")
+
+
+async def register_and_anonymize(options: Namespace, config: RunConfig, job: JobRecord, cube_con):
     """
     1) Search through PACS for series and register in CUBE
     2) Run anonymize and push workflow on the registered series
     """
-    d_job["pull"] = {
-        "url": options.PFDCMurl,
-        "pacs": options.PACSname
-    }
-    d_job["notify"] = {
-        "recipients": options.recipients,
-        "smtp_server": options.SMTPServer
-    }
-    d_job["push"] = {
-        "url": options.orthancUrl,
-        "username": options.orthancUsername,
-        "password": options.orthancPassword,
-        "aec": options.pushToRemote,
-        "wait": wait
-    }
-    d_job["preserve"] = {
-        "preserveTags": options.preserveTags
-    }
-    d_job["filter"] = {
-        "imgCount": options.imgCount,
-        "dicomFilter": options.dicomFilter
-    }
-    d_job["pipeline"] = {
-        "name": options.pipelineName,
-    }
-    LOG(d_job)
-    d_ret = await cube_con.anonymize(d_job, options.pluginInstanceID)
+    with logger.contextualize(job_id=job.id):
+        ROW_LOG(job)
+        d_ret = await cube_con.anonymize(job, options.pluginInstanceID, config)
     return d_ret
 
 
@@ -296,6 +914,9 @@ def health_check(options) -> bool:
     """
     check if connections to pfdcm and CUBE is valid
     """
+    import pfdcm
+    from chrisClient import ChrisClient
+
     try:
         if not options.pluginInstanceID:
             options.pluginInstanceID = os.environ['CHRIS_PREV_PLG_INST_ID']
@@ -320,7 +941,33 @@ def health_check(options) -> bool:
     return True
 
 # See PyCharm help at https://www.jetbrains.com/help/pycharm/
-def create_query(df: pd.DataFrame):
+def share_retrieves(l_job: list[JobRecord]) -> (list[JobRecord], dict[int, list[JobRecord]]):
+    """
+    Group rows that search the same PACS for the same studies with different
+    anonymization profiles. Only the first row of a group is scheduled; it
+    retrieves the studies and the other rows branch from its retrieve node.
+    Returns the rows to schedule and the rows that branch from each of them.
+    """
+    d_group = {}
+    for job in l_job:
+        key = (json.dumps(job.search, sort_keys=True, default=str), job.pacs, job.pfdcm)
+        d_group.setdefault(key, []).append(job)
+
+    l_first = []
+    d_branch = {}
+    for l_group in d_group.values():
+        first = l_group[0]
+        if len(l_group) > 1:
+            first.share_retrieve = True
+            d_branch[first.id] = l_group[1:]
+        l_first.append(first)
+    LOG(f"{len(l_job) - len(l_first)} of {len(l_job)} rows share a PACS retrieve with another row")
+    return l_first, d_branch
+
+
+def create_query(df: 'pd.DataFrame'):
+    import pandas as pd
+
     l_srch_idx = []
     l_anon_idx = []
     for column in df.columns:
@@ -330,20 +977,26 @@ def create_query(df: pd.DataFrame):
             l_anon_idx.append(df.columns.get_loc(column))
 
     l_job = []
+    s_keys = [k.split('.')[0].split('_')[1] for k in df.columns[l_srch_idx].values]
+    a_keys = [k.split('.')[0].split('_')[1] for k in df.columns[l_anon_idx].values]
+    l_hint = [(df.columns.get_loc(c), HINT_COLUMNS[str(c).lower()]) for c in df.columns
+              if str(c).lower() in HINT_COLUMNS]
 
-    for row in df.iterrows():
-        d_job = {}
+    for idx, row in zip(df.index, df.itertuples(index=False, name=None)):
+        # the first non-empty column of a duplicated key takes precedence; empty cells are left out
+        # so that no NaN reaches the PACS directive or the tag structure
+        search = dict(ChainMap(*[{k: row[i]} for k, i in zip(s_keys, l_srch_idx) if pd.notna(row[i])]))
+        anon = dict(ChainMap(*[{k: row[i]} for k, i in zip(a_keys, l_anon_idx) if pd.notna(row[i])]))
+        job = JobRecord(idx, search, anon)
 
-        s_col = (df.columns[l_srch_idx].values)
-        s_row = (row[1].iloc[l_srch_idx].values)
-        s_d = [{k.split('.')[0].split('_')[1]: v} for k, v in zip(s_col, s_row)]
-        d_job["search"] = dict(ChainMap(*s_d))
+        # optional scheduling and routing hints
+        for i, hint in l_hint:
+            if pd.notna(row[i]):
+                setattr(job, hint, row[i])
 
-        a_col = (df.columns[l_anon_idx].values)
-        a_row = (row[1].iloc[l_anon_idx].values)
-        a_d = [{k.split('.')[0].split('_')[1]: v} for k, v in zip(a_col, a_row)]
-        d_job["anon"] = dict(ChainMap(*a_d))
-
-        l_job.append(d_job)
+        l_job.append(job)
 
     return l_job
+
+if __name__ == '__main__':
+    main()
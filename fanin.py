@@ -0,0 +1,105 @@
+from __future__ import annotations
+from loguru import logger
+from typing import TYPE_CHECKING
+import threading
+
+if TYPE_CHECKING:
+    from runnable import Runnable
+
+LOG = logger.debug
+
+
+class FanIn:
+    """
+    Incrementally join leaf plugin instances into a tree of topological copies.
+
+    Leaves are buffered per tree level. As soon as a level holds ``group_size``
+    instances, a single `pl-topologicalcopy` is launched over that group and its
+    instance ID is promoted to the next level. Calling ``finalize`` flushes the
+    partially filled levels until exactly one root instance remains, on which the
+    reduce pipeline can run.
+    """
+
+    def __init__(self, run_obj: Runnable, group_size: int, reduce_filter: str):
+        self.run_obj = run_obj
+        self.group_size = max(2, int(group_size))
+        self.reduce_filter = reduce_filter
+        self.levels: list[list[int]] = [[]]
+        self.lock = threading.Lock()
+
+    def add(self, inst_id: int):
+        """
+        Add a completed leaf node to the bottom level of the tree.
+
+        Topological copies are launched outside the lock, so rows keep
+        completing while a group is being joined. If a launch fails, the
+        group's members go back to their level and are retried with the next
+        group or by ``finalize``.
+        """
+        level = 0
+        with self.lock:
+            self._promote(level, inst_id)
+            group = self._take(level)
+        while group:
+            try:
+                topo_id = self._join(group)
+            except RuntimeError as ex:
+                logger.error(ex)
+                with self.lock:
+                    self.levels[level].extend(group)
+                return
+            level += 1
+            with self.lock:
+                self._promote(level, topo_id)
+                group = self._take(level)
+
+    def finalize(self) -> int | None:
+        """
+        Join all remaining partial groups and return the ID of the root instance.
+        Raises RuntimeError if a topological copy can't be launched.
+        """
+        with self.lock:
+            level = 0
+            while True:
+                pending = self.levels[level]
+                higher = any(self.levels[level + 1:])
+                if not higher and len(pending) <= 1:
+                    if pending and level == 0:
+                        # a lone leaf still needs to be copied through the filter
+                        return self._join(pending)
+                    return pending[0] if pending else None
+                self.levels[level] = []
+                if len(pending) == 1:
+                    self._promote(level + 1, pending[0])
+                elif pending:
+                    self._promote(level + 1, self._join(pending))
+                level += 1
+
+    def _promote(self, level: int, inst_id: int):
+        if len(self.levels) <= level:
+            self.levels.append([])
+        self.levels[level].append(inst_id)
+
+    def _take(self, level: int) -> list[int]:
+        """
+        Remove and return the instances of a level once they fill a group.
+        """
+        if len(self.levels[level]) < self.group_size:
+            return []
+        group, self.levels[level] = self.levels[level], []
+        return group
+
+    def _join(self, group: list[int]) -> int:
+        """
+        Launch one topological copy over a group of plugin instances.
+        """
+        LOG(f"Joining plugin instances: {group}")
+        str_instances = ",".join(map(str, group))
+        str_filters = ",".join([self.reduce_filter] * len(group))
+        topo_id = self.run_obj.run_plugin(group[0], "pl-topologicalcopy", {
+            "plugininstances": str_instances,
+            "filter": str_filters,
+        })
+        if topo_id == -1:
+            raise RuntimeError(f"Error occurred while running topological copy on {group}")
+        return topo_id
@@ -0,0 +1,117 @@
+from argparse import Namespace
+from dataclasses import dataclass
+from functools import cached_property
+import json
+
+
+class JobRecord:
+    """
+    Slim per-row job: only the values that differ between rows of a manifest.
+    """
+    __slots__ = ("id", "search", "anon", "priority", "cost", "pacs", "pfdcm", "share_retrieve", "branch_from")
+
+    def __init__(self, id, search: dict, anon: dict, priority=None, cost=None, pacs=None, pfdcm=None):
+        self.id = id
+        self.search = search
+        self.anon = anon
+        self.priority = priority
+        self.cost = cost
+        # optional per-row routing; None means the run's --PACSname/--PFDCMurl
+        self.pacs = pacs
+        self.pfdcm = pfdcm
+        # rows sharing one PACS retrieve: the first reports its retrieve node, the others branch from it
+        self.share_retrieve = False
+        self.branch_from = None
+
+    def __repr__(self):
+        return f"JobRecord(id={self.id!r}, search={self.search!r}, anon={self.anon!r})"
+
+
+@dataclass(frozen=True)
+class RunConfig:
+    """
+    Run-wide options shared by every job, built once per run.
+    """
+    cube_url: str
+    pull_url: str
+    pacs_name: str
+    recipients: str
+    smtp_server: str
+    orthanc_url: str
+    orthanc_username: str
+    orthanc_password: str
+    push_to_remote: str
+    preserve_tags: str
+    img_count: str
+    dicom_filter: str
+    pipeline_name: str
+    branch_pipeline_name: str = ''
+
+    @classmethod
+    def from_options(cls, options: Namespace) -> 'RunConfig':
+        return cls(
+            cube_url=options.CUBEurl.rstrip('/'),
+            pull_url=options.PFDCMurl,
+            pacs_name=options.PACSname,
+            recipients=options.recipients,
+            smtp_server=options.SMTPServer,
+            orthanc_url=options.orthancUrl,
+            orthanc_username=options.orthancUsername,
+            orthanc_password=options.orthancPassword,
+            push_to_remote=options.pushToRemote,
+            preserve_tags=options.preserveTags,
+            img_count=options.imgCount,
+            dicom_filter=options.dicomFilter,
+            pipeline_name=options.pipelineName,
+            branch_pipeline_name=options.branchPipelineName
+        )
+
+    @cached_property
+    def params_template(self) -> dict:
+        """
+        Plugin parameters common to every row. Per-row slots are filled from ``row_params``.
+        """
+        return {
+            'PACS-query': {
+                "PACSurl": self.pull_url,
+                "PACSname": self.pacs_name,
+            },
+            'PACS-retrieve': {
+                "PACSurl": self.pull_url,
+                "PACSname": self.pacs_name,
+                "inputJSONfile": "search_results.json",
+                "copyInputFile": True
+            },
+            'verify-registration': {
+                "CUBEurl": self.cube_url,
+                "inputJSONfile": "search_results.json",
+                "orthancUrl": self.orthanc_url,
+                "orthancUsername": self.orthanc_username,
+                "orthancPassword": self.orthanc_password,
+                "PFDCMurl": self.pull_url,
+                "PACSname": self.pacs_name,
+                "pushToRemote": self.push_to_remote,
+                "SMTPServer": self.smtp_server,
+                "recipients": self.recipients,
+                "preserveTags": self.preserve_tags,
+                "imgCount": self.img_count,
+                "dicomFilter": self.dicom_filter
+            }
+        }
+
+    def row_params(self, job: JobRecord) -> dict:
+        """
+        The plugin parameters that differ per row; everything else comes from ``params_template``.
+        Rows routed to another PACS also override its name and pfdcm endpoint.
+        """
+        d_params = {
+            'PACS-query': {"PACSdirective": json.dumps(job.search)},
+            'verify-registration': {"tagStruct": json.dumps(job.anon)}
+        }
+        if job.pacs or job.pfdcm:
+            pacs_name = job.pacs or self.pacs_name
+            pull_url = job.pfdcm or self.pull_url
+            d_params['PACS-query'].update({"PACSurl": pull_url, "PACSname": pacs_name})
+            d_params['PACS-retrieve'] = {"PACSurl": pull_url, "PACSname": pacs_name}
+            d_params['verify-registration'].update({"PFDCMurl": pull_url, "PACSname": pacs_name})
+        return d_params
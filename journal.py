@@ -0,0 +1,19 @@
+from pathlib import Path
+import json
+import threading
+import time
+
+
+class Journal:
+    """
+    Append-only JSON lines record of run events, flushed after every entry.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+
+    def record(self, event: str, **fields):
+        entry = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "event": event, **fields}
+        with self.lock, open(self.path, "a") as f:
+            f.write(json.dumps(entry, default=str) + "\n")
@@ -0,0 +1,129 @@
+from loguru import logger
+import itertools
+import json
+import re
+import sys
+
+logger_format = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss}</green> │ "
+    "<level>{level: <5}</level> │ "
+    "<yellow>{name: >28}</yellow>::"
+    "<cyan>{function: <30}</cyan> @"
+    "<cyan>{line: <4}</cyan> ║ "
+    "<level>{message}</level>"
+)
+
+# matches `password: x`, `'orthancPassword': 'x'`, `"Authorization": "Token x"` and the like
+_secret_re = re.compile(
+    r"""(?i)(['"]?[\w-]*(?:password|token|secret|authorization)[\w-]*['"]?\s*[:=]\s*)(?:(['"])(.*?)\2|[^\s,}]+)"""
+)
+
+# name/value objects such as the nodes_info entry {"name": "orthancPassword", "default": "x"}, also
+# when that JSON is itself embedded as an escaped string; the value ends at the first quote escaped
+# exactly like the opening one, so a secret containing quotes, commas or braces is masked whole
+_pair_re = re.compile(
+    r"""(?i)((?P<q>\\*)['"]name(?P=q)['"]\s*:\s*(?P=q)['"][\w-]*(?:password|token|secret|authorization)[\w-]*"""
+    r"""(?P=q)['"][^{}]*?(?P=q)['"](?:default|value)(?P=q)['"]\s*:\s*)"""
+    r"""(?:(?P<vq>(?P=q)['"]).*?(?<!\\)(?P=vq)|[^\s,}]+)"""
+)
+
+_configured = False
+
+
+def _mask_pair(match: re.Match) -> str:
+    # unquoted values are masked as strings so that JSON messages stay valid
+    quote = match.group("vq") or f'{match.group("q")}"'
+    return f"{match.group(1)}{quote}***{quote}"
+
+
+def redact(message: str) -> str:
+    """
+    Mask the values of password, token and authorization fields in a message,
+    including name/value pairs whose name is such a field.
+    """
+    message = _pair_re.sub(_mask_pair, message)
+    return _secret_re.sub(lambda m: m.group(1) + (f"{m.group(2)}***{m.group(2)}" if m.group(2) else "***"), message)
+
+
+def _redact_record(record: dict):
+    record["message"] = redact(record["message"])
+
+
+def _json_format(record: dict) -> str:
+    """
+    Render a record as a single JSON line.
+    """
+    extra = {k: v for k, v in record["extra"].items() if not k.startswith("_") and k != "row_event"}
+    record["extra"]["_json"] = json.dumps({
+        "time": record["time"].isoformat(),
+        "level": record["level"].name,
+        "module": record["name"],
+        "function": record["function"],
+        "line": record["line"],
+        "job_id": extra.pop("job_id", None),
+        "message": record["message"],
+        "exception": str(record["exception"]) if record["exception"] else None,
+        **extra
+    }, default=str)
+    return "{extra[_json]}\n"
+
+
+def _text_format(record: dict) -> str:
+    prefix = "[job {extra[job_id]}] " if record["extra"].get("job_id") is not None else ""
+    return logger_format.replace("{message}", prefix + "{message}") + "\n{exception}"
+
+
+class LogFilter:
+    """
+    Per-module level gating plus sampling of per-row debug events.
+
+    ``module_levels`` is a comma separated list such as ``pfdcm=INFO,pipeline=WARNING``.
+    Records logged through ``ROW_LOG`` (bound with ``row_event``) are kept one in ``sample``.
+    """
+
+    def __init__(self, level: str = "DEBUG", module_levels: str = "", sample: int = 1):
+        self.level = logger.level(level.upper()).no
+        self.modules = []
+        for item in filter(None, module_levels.split(",")):
+            module, module_level = item.split("=")
+            self.modules.append((module.strip(), logger.level(module_level.strip().upper()).no))
+        # most specific module first
+        self.modules.sort(key=lambda m: -len(m[0]))
+        self.sample = max(1, sample)
+        self.counter = itertools.count()
+
+    def __call__(self, record: dict) -> bool:
+        name = record["name"] or ""
+        level = self.level
+        for module, module_level in self.modules:
+            if name == module or name.startswith(module + "."):
+                level = module_level
+                break
+        if record["level"].no < level:
+            return False
+        if self.sample > 1 and record["extra"].get("row_event"):
+            return next(self.counter) % self.sample == 0
+        return True
+
+
+def setup_logging(log_file: str = '', level: str = "DEBUG", fmt: str = "text", enqueue: bool = False,
+                  module_levels: str = "", sample: int = 1):
+    """
+    Replace loguru's default handler with the plugin's stderr sink.
+    This only happens once per process; an optional file sink is added on every call.
+
+    With ``enqueue`` set, sinks write from a background thread so that workers
+    never block on log I/O. Secrets are always redacted before any sink formats
+    the record.
+    """
+    global _configured
+    formatter = _json_format if fmt == "json" else _text_format
+    if not _configured:
+        logger.remove()
+        logger.configure(patcher=_redact_record)
+        logger.add(sys.stderr, format=formatter, level=0, enqueue=enqueue,
+                   filter=LogFilter(level, module_levels, sample))
+        _configured = True
+    if log_file:
+        logger.add(log_file, format=formatter, level=0, enqueue=enqueue,
+                   filter=LogFilter(level, module_levels, sample))
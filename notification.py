@@ -0,0 +1,116 @@
+from __future__ import annotations
+from loguru import logger
+from typing import TYPE_CHECKING
+import threading
+import time
+
+if TYPE_CHECKING:
+    from runnable import Runnable
+
+LOG = logger.debug
+
+
+class NotificationAggregator:
+    """
+    Collect pipeline failures during a run and send them as digests.
+
+    Failures are grouped per feed (and recipient list). Each group is emitted as
+    a single `pl-notification` instance either when the time window has elapsed
+    since the first pending failure, checked by a timer so that a lone failure is
+    not held back, or when ``flush`` is called at the end of the run.
+    Feed lookups and the notification plugin ID are cached across the run.
+    """
+
+    def __init__(self, run_obj: Runnable, window: float = 0):
+        self.run_obj = run_obj
+        self.window = window
+        self.pending: dict[tuple, list[dict]] = {}
+        self.first_failure = None
+        self.timer = None
+        self.feed_ids: dict[int, int] = {}
+        self.feed_details: dict[int, dict] = {}
+        self.plugin_id = None
+        self.lock = threading.Lock()
+
+    def add(self, pv_id: int, msg: str, rcpts: str, smtp: str, search_data):
+        """
+        Record a failure. A digest is sent if the current window has elapsed.
+        """
+        feed_id = self._get_feed_id(pv_id)
+        with self.lock:
+            self.pending.setdefault((feed_id, rcpts, smtp), []).append({
+                "previous_id": pv_id,
+                "msg": msg,
+                "search": search_data
+            })
+            if self.first_failure is None:
+                self.first_failure = time.monotonic()
+                if self.window > 0:
+                    self.timer = threading.Timer(self.window, self._flush_due)
+                    self.timer.daemon = True
+                    self.timer.start()
+            due = self.window > 0 and time.monotonic() - self.first_failure >= self.window
+        if due:
+            self.flush()
+
+    def _flush_due(self):
+        with self.lock:
+            due = self.first_failure is not None and time.monotonic() - self.first_failure >= self.window
+        if due:
+            self.flush()
+
+    def flush(self) -> list[int]:
+        """
+        Send one digest notification per pending feed group.
+        """
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+            self.first_failure = None
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+        l_inst = []
+        for (feed_id, rcpts, smtp), failures in pending.items():
+            l_inst.append(self._send_digest(feed_id, rcpts, smtp, failures))
+        return l_inst
+
+    def _get_feed_id(self, pv_id: int) -> int:
+        if pv_id not in self.feed_ids:
+            self.feed_ids[pv_id] = self.run_obj.get_feed_id_from_plugin_inst(pv_id)
+        return self.feed_ids[pv_id]
+
+    def _get_feed_details(self, feed_id: int) -> dict:
+        if feed_id not in self.feed_details:
+            self.feed_details[feed_id] = self.run_obj.get_feed_details_from_id(feed_id)
+        return self.feed_details[feed_id]
+
+    def _send_digest(self, feed_id: int, rcpts: str, smtp: str, failures: list[dict]) -> int:
+        """
+        Run a single pl-notification instance for a group of failures.
+        """
+        try:
+            feed_details = self._get_feed_details(feed_id)
+            l_lines = [f"- {failure['msg']}: {failure['search']}" for failure in failures]
+            email_content = (f"{len(failures)} error(s) occurred while fetching the following data from PACS: "
+                             f"\n" + "\n".join(l_lines) +
+                             f"\n\nFeed Name: {feed_details.get('name')}"
+                             f"\nDate: {feed_details.get('date')}"
+                             f"\n\nKindly login to ChRIS as *{feed_details.get('owner')}* to access the logs for more details.")
+
+            if self.plugin_id is None:
+                self.plugin_id = self.run_obj.get_plugin_id({"name": "pl-notification", "version": "0.1.0"})
+            instance_id = self.run_obj.create_plugin_instance(self.plugin_id, {
+                "previous_id": failures[0]["previous_id"],
+                "content": email_content,
+                "title": f"{len(failures)} pipeline failure(s) in feed {feed_details.get('name')}",
+                "rcpt": rcpts,
+                "sender": "noreply@fnndsc.org",
+                "mail_server": smtp
+            })
+            LOG(f"Sent digest of {len(failures)} failure(s) for feed {feed_id}")
+            return int(instance_id)
+        except Exception as ex:
+            logger.error(f"Error occurred while creating notification instance {ex}")
+            return -1
@@ -1,22 +1,13 @@
 import requests
 from loguru import logger
-import sys
+from profiler import stage
 import copy
 from collections import ChainMap
 import json
 
 LOG = logger.debug
+ROW_LOG = logger.bind(row_event=True).debug
 
-logger_format = (
-    "<green>{time:YYYY-MM-DD HH:mm:ss}</green> │ "
-    "<level>{level: <5}</level> │ "
-    "<yellow>{name: >28}</yellow>::"
-    "<cyan>{function: <30}</cyan> @"
-    "<cyan>{line: <4}</cyan> ║ "
-    "<level>{message}</level>"
-)
-logger.remove()
-logger.add(sys.stderr, format=logger_format)
 
 def health_check(url: str):
     pfdcm_about_api = f'{url}about/'
@@ -92,10 +83,11 @@ def register_pacsfiles(directive: dict, url: str, pacs_name: str):
         }
     }
     body["PACSdirective"].update(directive)
-    LOG(body)
+    ROW_LOG(body)
 
     try:
-        response = requests.post(pfdcm_dicom_api, json=body, headers=headers)
+        with stage("http_wait"):
+            response = requests.post(pfdcm_dicom_api, json=body, headers=headers)
         d_response = json.loads(response.text)
         if d_response['status']:
             return d_response
@@ -130,10 +122,11 @@ def get_pfdcm_status(directive: dict, url: str, pacs_name: str):
         }
     }
     body["PACSdirective"].update(directive)
-    LOG(body)
+    ROW_LOG(body)
 
     try:
-        response = requests.post(pfdcm_status_url, json=body, headers=headers)
+        with stage("http_wait"):
+            response = requests.post(pfdcm_status_url, json=body, headers=headers)
         d_response = json.loads(response.text)
         if d_response['status']: return d_response
         else: raise Exception(d_response['message'])
@@ -142,3 +135,76 @@ def get_pfdcm_status(directive: dict, url: str, pacs_name: str):
 
 
 
+# fields shared by directives that can be answered by a single broader query
+COALESCE_KEYS = ("PatientID", "StudyDate")
+
+
+def _value_matches(key: str, wanted, actual) -> bool:
+    """
+    Match a directive value against a series value: partial text for name and
+    description fields, inclusive ranges for dates and exact matches otherwise.
+    Values are compared as text; a series without a value doesn't match.
+    """
+    if actual is None:
+        return False
+    wanted, actual = str(wanted), str(actual)
+    if "Name" in key or "Description" in key:
+        return wanted.lower() in actual.lower()
+    if key.endswith("Date") and "-" in wanted:
+        start, _, end = wanted.partition("-")
+        return (not start or actual >= start) and (not end or actual <= end)
+    return wanted.lower() == actual.lower()
+
+
+def split_response(directive: dict, d_response: dict, skip_keys=()) -> dict:
+    """
+    Keep only the series of a (coalesced) pfdcm response that match a directive.
+    Fields missing from a series don't filter it out, as in ``autocomplete_directive``.
+    """
+    l_study = []
+    for study in d_response['pypx']['data']:
+        l_series = [series for series in study["series"]
+                    if all(value is None or key in skip_keys or not series.get(key)
+                           or _value_matches(key, value, series[key]["value"])
+                           for key, value in directive.items())]
+        if l_series:
+            l_study.append({**study, "series": l_series})
+    return {**d_response, "pypx": {**d_response['pypx'], "data": l_study}}
+
+
+def coalesce_directives(l_directive: list[dict]) -> list[(dict, list[int])]:
+    """
+    Group directives sharing the same PatientID/StudyDate into one broader query.
+    Returns a list of (query directive, indices of the original directives).
+    Directives without any coalescing field are queried on their own, sanitized.
+    """
+    d_group = {}
+    l_query = []
+    for idx, directive in enumerate(l_directive):
+        broad = {k: directive[k] for k in COALESCE_KEYS if isinstance(directive.get(k), str) and directive[k]}
+        if not broad:
+            l_query.append((sanitize(directive)[0], [idx]))
+            continue
+        d_group.setdefault(json.dumps(broad, sort_keys=True), (broad, []))[1].append(idx)
+    for broad, l_idx in d_group.values():
+        # a single directive keeps its exact (sanitized) query
+        query = sanitize(l_directive[l_idx[0]])[0] if len(l_idx) == 1 else broad
+        l_query.append((query, l_idx))
+    return l_query
+
+
+def query_coalesced(l_directive: list[dict], url: str, pacs_name: str) -> list[dict | None]:
+    """
+    Run the status queries of many directives with one C-FIND per compatible group
+    and split each response back to the directives of the group.
+    """
+    l_response = [None] * len(l_directive)
+    l_query = coalesce_directives(l_directive)
+    LOG(f"Coalesced {len(l_directive)} directives into {len(l_query)} PACS queries")
+    for query, l_idx in l_query:
+        d_response = get_pfdcm_status(query, url, pacs_name)
+        if not d_response:
+            continue
+        for idx in l_idx:
+            l_response[idx] = split_response(l_directive[idx], d_response, skip_keys=query.keys())
+    return l_response
@@ -4,10 +4,15 @@ from requests.auth import HTTPBasicAuth
 from requests.exceptions import RequestException, Timeout, HTTPError
 from tenacity import retry, wait_exponential, stop_after_attempt, retry_if_exception_type
 from loguru import logger
+from profiler import stage
 import time
-import asyncio
+import threading
+import hashlib
 from urllib.parse import urlencode
 
+# attempts at posting a workflow, each one preceded by a lookup of the previous attempt's workflow
+POST_ATTEMPTS = 3
+
 def transform_plugin_data(nested_data_list: list[dict]) -> list[dict]:
     """Flatten nested plugin data into a list of dictionaries."""
     flat_data = []
@@ -62,10 +67,187 @@ def compute_workflow_nodes_info(pipeline_default_parameters: list[dict], include
     return nodes_info
 
 
+class WorkflowTemplate:
+    """
+    A pipeline's ``nodes_info`` compiled once, with pipings indexed by title and
+    parameters indexed by name.
+
+    ``render`` patches only the parameters named by its overrides and shares
+    every untouched piping with the template, so preparing a row costs
+    O(overrides) instead of rebuilding the whole structure.
+    """
+
+    def __init__(self, pipeline_id: int, total_jobs: int, nodes_info: list[dict]):
+        self.pipeline_id = pipeline_id
+        self.total_jobs = total_jobs
+        self.nodes_info = nodes_info
+        self.param_index = [{param['name']: i for i, param in enumerate(piping.get('plugin_parameter_defaults', []))}
+                            for piping in nodes_info]
+        self.title_index: dict[str, list[int]] = {}
+
+    def pipings(self, plugin_title: str) -> list[int]:
+        """
+        Indices of the pipings whose title contains ``plugin_title``, as matched by ``update_plugin_parameters``.
+        """
+        l_idx = self.title_index.get(plugin_title)
+        if l_idx is None:
+            l_idx = [i for i, piping in enumerate(self.nodes_info) if plugin_title in piping.get('title', '')]
+            self.title_index[plugin_title] = l_idx
+        return l_idx
+
+    def render(self, plugin_params: dict) -> list[dict]:
+        """
+        Return the ``nodes_info`` with ``plugin_params`` applied. The template itself is never mutated.
+        """
+        nodes_info = list(self.nodes_info)
+        copied = set()
+        for plugin_title, new_params in plugin_params.items():
+            for i in self.pipings(plugin_title):
+                index = self.param_index[i]
+                for name, value in new_params.items():
+                    j = index.get(name)
+                    if j is None:
+                        continue
+                    if i not in copied:
+                        piping = nodes_info[i]
+                        nodes_info[i] = {**piping, 'plugin_parameter_defaults': list(piping['plugin_parameter_defaults'])}
+                        copied.add(i)
+                    nodes_info[i]['plugin_parameter_defaults'][j] = {'name': name, 'default': value}
+        return nodes_info
+
+    def specialize(self, plugin_params: dict) -> 'WorkflowTemplate':
+        """
+        Return a template with run-wide parameters already applied, sharing this template's indices.
+        """
+        template = WorkflowTemplate.__new__(WorkflowTemplate)
+        template.pipeline_id = self.pipeline_id
+        template.total_jobs = self.total_jobs
+        template.nodes_info = self.render(plugin_params)
+        template.param_index = self.param_index
+        template.title_index = self.title_index
+        return template
+
+
+class TemplateCache:
+    """
+    Compiled workflow templates shared by every ``Pipeline`` of a run.
+
+    Templates are keyed by pipeline name and by the run-wide parameter dict
+    they were specialized with, so a pipeline is fetched from CUBE once.
+    """
+
+    def __init__(self):
+        self.templates: dict[str, WorkflowTemplate] = {}
+        self.specialized: dict[tuple, tuple[dict, WorkflowTemplate]] = {}
+        self.lock = threading.Lock()
+
+    def get(self, pipe: 'Pipeline', pipeline_name: str, static_params: dict) -> WorkflowTemplate:
+        key = (pipeline_name, id(static_params))
+        entry = self.specialized.get(key)
+        # the entry keeps a reference to its parameters, so their id cannot be reused
+        if entry and entry[0] is static_params:
+            return entry[1]
+        with self.lock:
+            base = self.templates.get(pipeline_name)
+            if base is None:
+                base = self.templates[pipeline_name] = pipe.compile_template(pipeline_name)
+            template = base.specialize(static_params)
+            self.specialized[key] = (static_params, template)
+        return template
+
+
+def run_tag(run_inst) -> str:
+    """Title prefix shared by the workflows a run submits under a plugin instance."""
+    return f"dyanon:{run_inst}:"
+
+
+def workflow_tag(run_inst, key: str) -> str:
+    """Title of the workflow of one row, by which it is found again on retries and reruns."""
+    return f"{run_tag(run_inst)}{key}"
+
+
+def idempotency_key(row, previous_inst, compiled: dict) -> str:
+    """
+    Deterministic key of a row's workflow: the same row rendered to the same
+    nodes under the same plugin instance always gets the same key.
+    """
+    content = json.dumps([str(row), str(previous_inst), compiled["pipeline_name"], compiled["nodes_info"]],
+                         sort_keys=True)
+    return hashlib.sha1(content.encode()).hexdigest()[:16]
+
+
+class SubmittedWorkflows:
+    """
+    Workflows already submitted under a plugin instance, indexed by their title.
+
+    Each instance is searched once, the first time a row of a run hanging off
+    it is submitted; the run's own submissions are added as they are posted.
+    Searches run outside the index lock, so threads submitting under other
+    instances never wait for them. A title whose post failed is marked stale
+    and searched again on its next lookup, since CUBE may have created it.
+    """
+
+    def __init__(self):
+        self.runs: dict[str, dict[str, int]] = {}
+        # submissions recorded while their instance is still being searched
+        self.pending: dict[str, dict[str, int]] = {}
+        self.loading: dict[str, threading.Lock] = {}
+        self.stale: set[str] = set()
+        self.lock = threading.Lock()
+
+    def get(self, pipe: 'Pipeline', run_inst, tag: str) -> int | None:
+        run = str(run_inst)
+        with self.lock:
+            loading = self.loading.setdefault(run, threading.Lock())
+        with loading:
+            with self.lock:
+                loaded = run in self.runs
+            if not loaded:
+                try:
+                    d_title = pipe.find_workflows(run_tag(run_inst))
+                except Exception as ex:
+                    logger.warning(f"Could not look up the workflows of plugin instance {run_inst}: {ex}")
+                    d_title = {}
+                with self.lock:
+                    self.runs[run] = {**d_title, **self.pending.pop(run, {})}
+        with self.lock:
+            if tag not in self.stale:
+                return self.runs[run].get(tag)
+        # outcome of a failed post: ask CUBE again
+        workflow_id = pipe.find_workflows(tag).get(tag)
+        with self.lock:
+            self.stale.discard(tag)
+            if workflow_id is not None:
+                self.runs[run][tag] = workflow_id
+        return workflow_id
+
+    def add(self, run_inst, tag: str, workflow_id: int):
+        run = str(run_inst)
+        with self.lock:
+            self.stale.discard(tag)
+            self.runs.get(run, self.pending.setdefault(run, {}))[tag] = workflow_id
+
+    def invalidate(self, tag: str):
+        """
+        Forget what is known about a title after a post that may or may not have created it.
+        """
+        with self.lock:
+            self.stale.add(tag)
+
+
 class Pipeline:
-    def __init__(self, url: str, token: str):
+    def __init__(self, url: str, token: str, notifier=None, tracker=None, history=None, templates=None,
+                 session=None, workflows=None, cancel_event: threading.Event = None):
         self.api_base = url.rstrip('/')
         self.headers = {"Content-Type": "application/json", "Authorization": f"Token {token}"}
+        self.notifier = notifier
+        self.tracker = tracker
+        self.history = history
+        self.templates = templates
+        self.workflows = workflows
+        self.cancel_event = cancel_event
+        # a shared requests.Session keeps connections to CUBE alive across workflows
+        self.session = session or requests
 
     # --------------------------
     # Retryable request handler
@@ -78,7 +260,8 @@ class Pipeline:
     )
     def make_request(self, method: str, endpoint: str, **kwargs):
         url = f"{self.api_base}{endpoint}"
-        response = requests.request(method, url, headers=self.headers, timeout=30, **kwargs)
+        with stage("http_wait"):
+            response = self.session.request(method, url, headers=self.headers, timeout=30, **kwargs)
         response.raise_for_status()
 
         try:
@@ -88,7 +271,8 @@ class Pipeline:
 
     def post_request(self, endpoint: str, **kwargs):
         url = f"{self.api_base}{endpoint}"
-        response = requests.request("POST", url, headers=self.headers, timeout=30, **kwargs)
+        with stage("http_wait"):
+            response = self.session.request("POST", url, headers=self.headers, timeout=30, **kwargs)
         response.raise_for_status()
 
         try:
@@ -122,6 +306,23 @@ class Pipeline:
         response = self.make_request("GET", f"/pipelines/{pipeline_id}/parameters/?limit=1000")
         return transform_plugin_data(response)
 
+    def compile_template(self, pipeline_name: str) -> WorkflowTemplate:
+        """Fetch a pipeline and compile its default parameters into a template."""
+        pipeline_id = self.get_pipeline_id(pipeline_name)
+        if pipeline_id == -1:
+            # raised before the template cache stores anything, so a pipeline added later is still found
+            raise RuntimeError(f"No pipeline named {pipeline_name!r} found in CUBE")
+        total_jobs = self.get_pipeline_total_pipings(pipeline_id)
+        default_params = self.get_pipeline_parameters(pipeline_id)
+        nodes_info = compute_workflow_nodes_info(default_params, include_all_defaults=True)
+        return WorkflowTemplate(pipeline_id, total_jobs, nodes_info)
+
+    def get_template(self, pipeline_name: str, static_params: dict) -> WorkflowTemplate:
+        """Return the compiled template of a pipeline, from the run's cache if there is one."""
+        if self.templates is not None:
+            return self.templates.get(self, pipeline_name, static_params)
+        return self.compile_template(pipeline_name).specialize(static_params)
+
     def get_feed_id_from_plugin_inst(self, plugin_inst: int) -> int:
         """Get feed_id from a given plugin instance"""
         logger.info(f"Fetching feed id for plugin instance with ID: {plugin_inst}")
@@ -184,7 +385,19 @@ class Pipeline:
         return plugin_instance_ids[-1] if plugin_instance_ids else None
 
 
-    def post_workflow(self, pipeline_id: int, previous_id: int, params: list[dict]) -> int:
+    def get_workflow_node(self, workflow_id: int, title: str) -> int | None:
+        """
+        Return the plugin instance of a workflow whose title contains ``title``.
+        """
+        logger.info(f"Getting {title} node for workflow with ID: {workflow_id}")
+        plugin_instances = self.make_request("GET", f"/pipelines/workflows/{workflow_id}/plugininstances/")
+        for plugin_instance in plugin_instances:
+            d_inst = {field.get("name"): field.get("value") for field in plugin_instance.get("data", [])}
+            if title in (d_inst.get("title") or ""):
+                return d_inst.get("id")
+        return None
+
+    def post_workflow(self, pipeline_id: int, previous_id: int, params: list[dict], title: str = None) -> int:
         """
         Trigger a pipeline workflow in CUBE.
         """
@@ -192,6 +405,8 @@ class Pipeline:
             "previous_plugin_inst_id": previous_id,
             "nodes_info": json.dumps(params)
         }
+        if title:
+            payload["title"] = title
         response = self.post_request(f"/pipelines/{pipeline_id}/workflows/", json=payload)
         for item in response:
             for field in item.get("data", []):
@@ -199,11 +414,66 @@ class Pipeline:
                     return field.get("value")
         return -1
 
+    def find_workflows(self, title: str) -> dict[str, int]:
+        """
+        Return the IDs of the workflows whose title contains ``title``, by title;
+        the latest workflow wins if several share a title.
+        """
+        d_title = {}
+        offset = 0
+        while True:
+            response = self.make_request("GET", "/pipelines/workflows/search/",
+                                         params={"title": title, "limit": 100, "offset": offset})
+            for item in response:
+                d_workflow = {field.get("name"): field.get("value") for field in item.get("data", [])}
+                name, workflow_id = d_workflow.get("title"), d_workflow.get("id")
+                if name and workflow_id is not None and workflow_id > d_title.get(name, -1):
+                    d_title[name] = workflow_id
+            if len(response) < 100:
+                return d_title
+            offset += 100
+
+    def post_workflow_once(self, pipeline_id: int, previous_id: int, params: list[dict], tag: str) -> int:
+        """
+        Post a workflow titled ``tag``, retrying transient failures only after
+        checking that the failed post did not create it after all.
+        """
+        for attempt in range(1, POST_ATTEMPTS + 1):
+            try:
+                return self.post_workflow(pipeline_id, previous_id, params, title=tag)
+            except (Timeout, requests.ConnectionError, HTTPError) as ex:
+                server_error = not isinstance(ex, HTTPError) or (ex.response is not None
+                                                                  and ex.response.status_code >= 500)
+                if not server_error or attempt == POST_ATTEMPTS:
+                    raise
+                logger.warning(f"Posting workflow {tag} failed: {ex}")
+                time.sleep(min(2 ** attempt, 10))
+                if (workflow_id := self.find_workflows(tag).get(tag)) is not None:
+                    logger.info(f"Reconciled failed post with workflow {workflow_id}")
+                    return workflow_id
+
+    def existing_workflow(self, run_inst, tag: str) -> int | None:
+        """
+        Return the workflow a previous attempt or run submitted for ``tag``,
+        unless it failed or was cancelled.
+        """
+        if self.workflows is not None:
+            workflow_id = self.workflows.get(self, run_inst, tag)
+        else:
+            workflow_id = self.find_workflows(tag).get(tag)
+        if workflow_id is None:
+            return None
+        d_status = self._get_workflow_status(workflow_id)
+        if d_status["workflow_failed"] or d_status["workflow_cancelled"]:
+            logger.info(f"Resubmitting {tag}: workflow {workflow_id} failed or was cancelled")
+            return None
+        return workflow_id
+
     def _get_workflow_status(self, workflow_id: int) -> dict:
         """
         1. Get workflow details for a given workflow id.
         2. Check for errored jobs
-        3. return total jobs (finished + errored + canceled)
+        3. return total jobs (finished + errored + canceled) and active jobs
         """
         finished_jobs = 0
         errored_jobs = 0
@@ -239,26 +509,63 @@ class Pipeline:
         return {
             "finished_jobs": finished_jobs,
             "total_jobs": finished_jobs + errored_jobs + cancelled_jobs + created_jobs + waiting_jobs + scheduled_jobs + started_jobs + registering_jobs,
-            "workflow_failed": (errored_jobs > 0)
+            "active_jobs": created_jobs + waiting_jobs + scheduled_jobs + started_jobs + registering_jobs,
+            "workflow_failed": (errored_jobs > 0),
+            "workflow_cancelled": (cancelled_jobs > 0)
         }
 
-    async def monitor_pipeline(self, workflow_id, total_jobs, pv_inst, rcpts, smtp, search_data):
-        d_search_data = json.loads(search_data)
-        while True:
-            status = self._get_workflow_status(workflow_id)
-            if status["workflow_failed"]:
-                logger.error("Pipeline failed.")
-                self.run_notification_plugin(pv_inst, "Pipeline failed with errors", rcpts, smtp, d_search_data)
-                break
-            if status["finished_jobs"] >= total_jobs:
-                logger.info("Pipeline complete.")
-                leaf_node_id = self.get_workflow_leaf_node(workflow_id)
-                return leaf_node_id
-                break
-            if status["total_jobs"] < total_jobs:
-                self.run_notification_plugin(pv_inst, "Nodes deleted in pipeline", rcpts, smtp, d_search_data)
-                break
-            time.sleep(20)
+    async def monitor_pipeline(self, workflow_id, total_jobs, pv_inst, rcpts, smtp, search_data,
+                               pipeline_name: str = '', img_count=None) -> dict:
+        """
+        Poll a workflow until it ends and return its final status, with its leaf node once complete.
+        """
+        with stage("monitor_polling"):
+            d_search_data = json.loads(search_data)
+            start = time.monotonic()
+            expected = self.history.estimate(pipeline_name, img_count) if self.history else None
+            cancelled = {"status": "Failed", "error": "Run cancelled while monitoring", "leaf_node_id": None}
+            if expected:
+                # don't poll workflows that historically take long; wake up around half way
+                if self._pause(expected / 2):
+                    return cancelled
+            while True:
+                status = self._get_workflow_status(workflow_id)
+                if status["workflow_failed"]:
+                    logger.error("Pipeline failed.")
+                    self.notify(pv_inst, "Pipeline failed with errors", rcpts, smtp, d_search_data)
+                    return {"status": "Failed", "error": "Pipeline failed with errors", "leaf_node_id": None}
+                if status["workflow_cancelled"]:
+                    logger.warning("Pipeline cancelled.")
+                    return {"status": "Failed", "error": "Pipeline cancelled", "leaf_node_id": None}
+                if status["finished_jobs"] >= total_jobs:
+                    logger.info("Pipeline complete.")
+                    if self.history:
+                        self.history.record(pipeline_name, img_count, time.monotonic() - start)
+                    return {"status": "Pipeline complete", "leaf_node_id": self.get_workflow_leaf_node(workflow_id)}
+                if status["total_jobs"] < total_jobs:
+                    self.notify(pv_inst, "Nodes deleted in pipeline", rcpts, smtp, d_search_data)
+                    return {"status": "Failed", "error": "Nodes deleted in pipeline", "leaf_node_id": None}
+                if self._pause(20):
+                    logger.warning("Run cancelled; no longer monitoring workflow.")
+                    return cancelled
+
+    def _pause(self, seconds: float) -> bool:
+        """
+        Sleep between two polls; return True as soon as the run is cancelled.
+        """
+        if self.cancel_event is None:
+            time.sleep(seconds)
+            return False
+        return self.cancel_event.wait(seconds)
+
+    def notify(self, pv_id: int, msg: str, rcpts: str, smtp: str, search_data: str):
+        """
+        Report a failure through the run's aggregator if present, else notify immediately.
+        """
+        if self.notifier:
+            self.notifier.add(pv_id, msg, rcpts, smtp, search_data)
+        else:
+            self.run_notification_plugin(pv_id, msg, rcpts, smtp, search_data)
 
     def run_notification_plugin(self, pv_id: int, msg: str, rcpts: str, smtp: str, search_data: str) -> int:
         """
@@ -322,37 +629,94 @@ class Pipeline:
 
         raise RuntimeError(f"No plugin found with matching criteria: {params}")
 
-    async def run_pipeline(self, pipeline_name: str, previous_inst: int, pipeline_params: dict):
+    def compile_workflow(self, pipeline_name: str, pipeline_params: dict, row_params: dict = None) -> dict:
+        """
+        Render the nodes_info of a workflow from the compiled pipeline template
+        and gather what submitting and monitoring it needs.
+
+        ``pipeline_params`` are applied once per template and should be the same
+        object for every row of a run; ``row_params`` only hold the values that differ per row.
+        """
+        row_params = row_params or {}
+
+        def param(plugin_title: str, name: str):
+            return row_params.get(plugin_title, {}).get(name, pipeline_params.get(plugin_title, {}).get(name))
+
+        with stage("job_prep"):
+            template = self.get_template(pipeline_name, pipeline_params)
+            return {
+                "pipeline_name": pipeline_name,
+                "pipeline_id": template.pipeline_id,
+                "total_jobs": template.total_jobs,
+                "nodes_info": template.render(row_params),
+                "smtp_server": param("verify-registration", "SMTPServer"),
+                "recipients": param("verify-registration", "recipients"),
+                "search_data": json.dumps(param("PACS-query", "PACSdirective"))
+            }
+
+    def submit_workflow(self, compiled: dict, previous_inst: int, run_inst=None, key: str = None) -> dict:
+        """
+        Post a compiled workflow and resolve its current leaf node.
+
+        With an idempotency ``key``, the workflow is titled after it and the run's
+        plugin instance ``run_inst``; a live workflow already carrying that title is
+        reused instead of posting the row again.
+        """
+        if key is None:
+            workflow_id = self.post_workflow(pipeline_id=compiled["pipeline_id"], previous_id=previous_inst,
+                                             params=compiled["nodes_info"])
+        else:
+            run_inst = previous_inst if run_inst is None else run_inst
+            tag = workflow_tag(run_inst, key)
+            workflow_id = self.existing_workflow(run_inst, tag)
+            if workflow_id is not None:
+                logger.info(f"Reusing workflow {workflow_id} already submitted as {tag}")
+            else:
+                try:
+                    workflow_id = self.post_workflow_once(compiled["pipeline_id"], previous_inst,
+                                                          compiled["nodes_info"], tag)
+                    if workflow_id == -1:
+                        raise RuntimeError(f"CUBE did not return the ID of workflow {tag}")
+                except Exception:
+                    # the post may have created the workflow; a retry of the row looks it up again
+                    if self.workflows is not None:
+                        self.workflows.invalidate(tag)
+                    raise
+                if self.workflows is not None:
+                    self.workflows.add(run_inst, tag, workflow_id)
+        if workflow_id == -1:
+            raise RuntimeError("CUBE did not return the ID of the posted workflow")
+        if self.tracker:
+            self.tracker.track(workflow_id, compiled["total_jobs"])
+        leaf_node_id = self.get_workflow_leaf_node(workflow_id)
+        logger.info(f"Workflow posted successfully")
+        return {"status": "Pipeline running", "workflow_id": workflow_id, "leaf_node_id": leaf_node_id}
+
+    async def await_workflow(self, compiled: dict, submitted: dict, previous_inst: int, img_count=None) -> dict:
+        """
+        Wait for a submitted workflow to finish if failures are to be notified,
+        returning the submission with its final status and leaf node.
+        """
+        if compiled["recipients"]:
+            d_final = await self.monitor_pipeline(
+                submitted["workflow_id"], compiled["total_jobs"], previous_inst, compiled["recipients"],
+                compiled["smtp_server"], compiled["search_data"], compiled["pipeline_name"], img_count)
+            return {**submitted, **d_final}
+        return submitted
+
+    async def run_pipeline(self, pipeline_name: str, previous_inst: int, pipeline_params: dict, img_count=None,
+                           row_params: dict = None):
         """
         Full workflow to:
-        1. Fetch pipeline ID
-        2. Get default parameters
-        3. Update them
-        4. Trigger the pipeline
-        """
-        smtp_server = pipeline_params.get("verify-registration", {}).get("SMTPServer")
-        recipients = pipeline_params.get("verify-registration", {}).get("recipients")
-        search_data = pipeline_params.get("PACS-query", {}).get("PACSdirective")
-        search_data = json.dumps(search_data)
+        1. Fetch the compiled pipeline template
+        2. Apply the per-row parameters
+        3. Trigger the pipeline
+        4. Monitor it if recipients are set
+        """
         try:
-            pipeline_id = self.get_pipeline_id(pipeline_name)
-            total_jobs = self.get_pipeline_total_pipings(pipeline_id)
-            default_params = self.get_pipeline_parameters(pipeline_id)
-            nodes_info = compute_workflow_nodes_info(default_params, include_all_defaults=True)
-            updated_params = update_plugin_parameters(nodes_info, pipeline_params)
-            workflow_id = self.post_workflow(pipeline_id=pipeline_id, previous_id=previous_inst, params=updated_params)
-            leaf_node_id = self.get_workflow_leaf_node(workflow_id)
-
-            if recipients:
-
-                # Start this in the background (not awaited)
-                task = asyncio.create_task(
-                    self.monitor_pipeline(workflow_id, total_jobs, previous_inst, recipients, smtp_server, search_data))
-                result = await task
-                leaf_node_id = result
-
-            logger.info(f"Workflow posted successfully")
-            return {"status": "Pipeline running", "leaf_node_id": leaf_node_id}
+            compiled = self.compile_workflow(pipeline_name, pipeline_params, row_params)
+            submitted = self.submit_workflow(compiled, previous_inst)
+            return await self.await_workflow(compiled, submitted, previous_inst, img_count)
         except Exception as ex:
             logger.error(f"Running pipeline failed due to: {ex}")
-            return {"status": "Failed", "error": str(ex)}
\ No newline at end of file
+            return {"status": "Failed", "error": str(ex)}
@@ -0,0 +1,112 @@
+from loguru import logger
+from collections import deque
+from datetime import datetime, timedelta
+import re
+import time
+
+LOG = logger.debug
+
+DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+_window_re = re.compile(r"^(?:([A-Za-z]{3})(?:-([A-Za-z]{3}))?\s+)?(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})$")
+
+
+class SubmissionWindows:
+    """
+    Local time windows during which rows may be submitted.
+
+    Windows are given as comma separated ``[Day[-Day] ]HH:MM-HH:MM`` entries,
+    e.g. ``"Mon-Fri 19:00-07:00,Sat-Sun 00:00-24:00"``. A window that ends
+    before it starts runs past midnight; its day refers to the day it starts.
+    An empty specification allows submissions at any time.
+    """
+
+    def __init__(self, spec: str = ''):
+        self.windows: list[tuple[set[int], timedelta, timedelta]] = []
+        for entry in filter(None, (e.strip() for e in spec.split(','))):
+            match = _window_re.match(entry)
+            if not match:
+                raise ValueError(f"Invalid submission window: {entry}")
+            first, last, start_h, start_m, end_h, end_m = match.groups()
+            start = timedelta(hours=int(start_h), minutes=int(start_m))
+            end = timedelta(hours=int(end_h), minutes=int(end_m))
+            if start >= timedelta(days=1) or end > timedelta(days=1):
+                raise ValueError(f"Invalid submission window: {entry}")
+            if end <= start:
+                end += timedelta(days=1)
+            self.windows.append((self._days(first, last, entry), start, end))
+
+    @staticmethod
+    def _days(first: str, last: str, entry: str) -> set[int]:
+        if not first:
+            return set(range(7))
+        try:
+            i = DAYS.index(first.lower())
+            j = DAYS.index((last or first).lower())
+        except ValueError:
+            raise ValueError(f"Invalid day in submission window: {entry}")
+        return {(i + k) % 7 for k in range((j - i) % 7 + 1)}
+
+    def seconds_until_open(self, now: datetime = None) -> float:
+        """
+        Return 0 inside a window, else the number of seconds until the next window opens.
+        """
+        if not self.windows:
+            return 0.0
+        now = now or datetime.now()
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        l_start = []
+        # a window opened yesterday may still be open; one opening in the next week always exists
+        for offset in range(-1, 8):
+            day = midnight + timedelta(days=offset)
+            for days, start, end in self.windows:
+                if day.weekday() not in days:
+                    continue
+                if day + start <= now < day + end:
+                    return 0.0
+                if day + start > now:
+                    l_start.append(day + start)
+        return (min(l_start) - now).total_seconds()
+
+
+class HourlyQuota:
+    """
+    Sliding one-hour budget of submitted studies (rows) and images.
+
+    A limit of 0 disables it. A single row whose image count exceeds the budget
+    is still let through once the past hour is empty, so it can't block forever.
+    """
+
+    def __init__(self, studies: int = 0, images: int = 0):
+        self.studies = studies
+        self.images = images
+        self.history: deque[tuple[float, float]] = deque()
+
+    def _expire(self, now: float):
+        while self.history and self.history[0][0] <= now - 3600:
+            self.history.popleft()
+
+    def ready_in(self, images: float = 0.0) -> float:
+        """
+        Seconds until a row of ``images`` images fits into the budget.
+        """
+        if not self.studies and not self.images:
+            return 0.0
+        now = time.monotonic()
+        self._expire(now)
+        wait = 0.0
+        if self.studies and len(self.history) >= self.studies:
+            wait = self.history[len(self.history) - self.studies][0] + 3600 - now
+        if self.images and images:
+            used = sum(n for _, n in self.history)
+            # drop the oldest submissions until the new row fits
+            for at, n in self.history:
+                if used + images <= self.images:
+                    break
+                used -= n
+                wait = max(wait, at + 3600 - now)
+        return max(0.0, wait)
+
+    def record(self, images: float = 0.0):
+        if self.studies or self.images:
+            self.history.append((time.monotonic(), images))
@@ -0,0 +1,165 @@
+from loguru import logger
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+import json
+import os
+import sys
+import threading
+import time
+
+LOG = logger.debug
+
+STAGES = ("csv_load", "create_query", "job_prep", "http_wait", "monitor_polling", "reduce")
+
+# bounds that keep the sampler cheap and its memory flat on long runs
+MAX_DEPTH = 64
+MAX_STACKS = 50_000
+
+_profiler = None
+_null = nullcontext()
+
+
+class Profiler:
+    """
+    Sampling profiler for production runs.
+
+    A daemon thread records the stack of every other thread each ``interval``
+    seconds; nothing is traced, so the cost is independent of how much code
+    runs. Samples are keyed by the innermost stage active on the sampled
+    thread, and stage wall and CPU times are accounted exclusively: time spent
+    in a nested stage (e.g. an HTTP request during monitoring) is only counted
+    for the nested one.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.stacks: dict[str, int] = {}
+        self.samples = 0
+        self.dropped = 0
+        self.active: dict[int, list[str]] = {}
+        self.local = threading.local()
+        self.totals = {name: {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "samples": 0}
+                       for name in STAGES}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self.start = time.monotonic()
+
+    @contextmanager
+    def stage(self, name: str):
+        thread_id = threading.get_ident()
+        l_stage = self.active.setdefault(thread_id, [])
+        l_frame = self.local.__dict__.setdefault("frames", [])
+        # [wall start, cpu start, wall spent in nested stages, cpu spent in nested stages]
+        frame = [time.perf_counter(), time.thread_time(), 0.0, 0.0]
+        l_stage.append(name)
+        l_frame.append(frame)
+        try:
+            yield
+        finally:
+            l_stage.pop()
+            l_frame.pop()
+            if not l_stage:
+                self.active.pop(thread_id, None)
+            wall = time.perf_counter() - frame[0]
+            cpu = time.thread_time() - frame[1]
+            if l_frame:
+                l_frame[-1][2] += wall
+                l_frame[-1][3] += cpu
+            with self.lock:
+                d_total = self.totals.setdefault(name, {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0,
+                                                        "samples": 0})
+                d_total["calls"] += 1
+                d_total["wall_seconds"] += wall - frame[2]
+                d_total["cpu_seconds"] += cpu - frame[3]
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            try:
+                self._sample(own)
+            except Exception as ex:
+                # never let profiling take the run down
+                LOG(f"Profiler sample failed: {ex}")
+
+    def _sample(self, own: int):
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            l_stage = self.active.get(thread_id)
+            stage = l_stage[-1] if l_stage else "other"
+            l_name = []
+            while frame is not None and len(l_name) < MAX_DEPTH:
+                code = frame.f_code
+                l_name.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            key = ";".join([stage, *reversed(l_name)])
+            with self.lock:
+                self.samples += 1
+                if stage in self.totals:
+                    self.totals[stage]["samples"] += 1
+                if key in self.stacks:
+                    self.stacks[key] += 1
+                elif len(self.stacks) < MAX_STACKS:
+                    self.stacks[key] = 1
+                else:
+                    self.dropped += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join(timeout=1)
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {
+                "wall_seconds": round(time.monotonic() - self.start, 3),
+                "interval_seconds": self.interval,
+                "samples": self.samples,
+                "dropped_stacks": self.dropped,
+                "stages": {name: {k: round(v, 3) if isinstance(v, float) else v for k, v in d.items()}
+                           for name, d in self.totals.items()}
+            }
+
+    def write(self, outputdir: Path):
+        """
+        Write ``profile.collapsed`` (one ``frame;frame;... count`` line per stack,
+        as read by flamegraph.pl and speedscope) and ``profile-summary.json``.
+        Stage times are summed over threads, so they may exceed the run's wall time.
+        """
+        outputdir = Path(outputdir)
+        with self.lock:
+            lines = [f"{key} {count}\n" for key, count in sorted(self.stacks.items())]
+        (outputdir / "profile.collapsed").write_text("".join(lines))
+        (outputdir / "profile-summary.json").write_text(json.dumps(self.summary(), indent=2))
+
+
+def start(interval: float = 0.01) -> Profiler:
+    """
+    Start the process-wide profiler.
+    """
+    global _profiler
+    _profiler = Profiler(interval)
+    _profiler.thread.start()
+    return _profiler
+
+
+def finish(outputdir: Path):
+    """
+    Stop the profiler, if running, and write its reports to ``outputdir``.
+    """
+    global _profiler
+    if _profiler is None:
+        return
+    profiler, _profiler = _profiler, None
+    profiler.stop()
+    try:
+        profiler.write(outputdir)
+    except OSError as ex:
+        logger.error(f"Could not write profile: {ex}")
+
+
+def stage(name: str):
+    """
+    Account the enclosed block to a stage; a no-op unless profiling.
+    """
+    return _profiler.stage(name) if _profiler is not None else _null
@@ -0,0 +1,165 @@
+from loguru import logger
+from pathlib import Path
+import json
+import math
+import os
+import threading
+import time
+
+LOG = logger.debug
+
+
+def count_bucket(img_count) -> int:
+    """
+    Bucket an expected image count to the next power of two; 0 means unknown.
+    """
+    try:
+        count = int(float(img_count))
+    except (TypeError, ValueError):
+        return 0
+    return 2 ** math.ceil(math.log2(count)) if count > 0 else 0
+
+
+def default_history_path() -> Path:
+    """
+    Location of the duration history shared by successive runs: ``$XDG_CACHE_HOME/pl-dyanon``,
+    falling back to ``~/.cache/pl-dyanon``. A run's output directory is new every time,
+    so a history kept there would never be read again.
+    """
+    cache = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache) / "pl-dyanon" / "duration_history.json"
+
+
+class DurationHistory:
+    """
+    Persisted mean workflow durations per pipeline name and image-count bucket.
+
+    The file is meant to outlive the run; failing to write it only loses the update.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        try:
+            self.stats: dict[str, dict] = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            self.stats = {}
+
+    @staticmethod
+    def _key(pipeline_name: str, img_count) -> str:
+        return f"{pipeline_name}|{count_bucket(img_count)}"
+
+    def record(self, pipeline_name: str, img_count, seconds: float):
+        """
+        Add a completed workflow duration and persist the updated history.
+        """
+        with self.lock:
+            stat = self.stats.setdefault(self._key(pipeline_name, img_count), {"count": 0, "mean": 0.0})
+            stat["count"] += 1
+            stat["mean"] += (seconds - stat["mean"]) / stat["count"]
+            self._save()
+
+    def estimate(self, pipeline_name: str, img_count=None) -> float | None:
+        """
+        Expected duration of a workflow, falling back to the mean over all buckets of the pipeline.
+        """
+        with self.lock:
+            stat = self.stats.get(self._key(pipeline_name, img_count))
+            if stat:
+                return stat["mean"]
+            l_stat = [v for k, v in self.stats.items() if k.split('|')[0] == pipeline_name]
+        total = sum(v["count"] for v in l_stat)
+        return sum(v["mean"] * v["count"] for v in l_stat) / total if total else None
+
+    def _save(self):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self.stats, indent=2))
+            os.replace(tmp, self.path)
+        except OSError as ex:
+            LOG(f"Could not save duration history to {self.path}: {ex}")
+
+
+class ProgressReporter:
+    """
+    Keep ``progress.json`` up to date with row counts, throughput and an ETA.
+
+    Until a few rows have completed, the ETA is derived from the duration history
+    of the pipeline; afterwards from the observed throughput of the run. With a
+    PACS router, the counters of every PACS lane are reported as well.
+    """
+
+    def __init__(self, path: Path, history: DurationHistory, pipeline_name: str, workers: int,
+                 interval: float = 5.0, router=None):
+        self.path = Path(path)
+        self.router = router
+        self.history = history
+        self.pipeline_name = pipeline_name
+        self.workers = max(1, workers)
+        self.interval = interval
+        self.queued = 0
+        self.in_flight = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.start = time.monotonic()
+        self.last_write = 0.0
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+
+    def add_queued(self, count: int):
+        with self.lock:
+            self.queued += count
+        self.write()
+
+    def submitted(self):
+        with self.lock:
+            self.queued -= 1
+            self.in_flight += 1
+        self.write()
+
+    def finished(self, success: bool):
+        with self.lock:
+            self.in_flight -= 1
+            if success:
+                self.succeeded += 1
+            else:
+                self.failed += 1
+        self.write()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            elapsed = time.monotonic() - self.start
+            done = self.succeeded + self.failed
+            remaining = self.queued + self.in_flight
+            throughput = done / elapsed if elapsed > 0 else 0.0
+            eta = None
+            if done >= 3 and throughput > 0:
+                eta = remaining / throughput
+            elif (expected := self.history.estimate(self.pipeline_name)) is not None:
+                eta = math.ceil(remaining / self.workers) * expected
+            d_snapshot = {
+                "queued": self.queued,
+                "in_flight": self.in_flight,
+                "succeeded": self.succeeded,
+                "failed": self.failed,
+                "elapsed_seconds": round(elapsed, 1),
+                "throughput_per_minute": round(throughput * 60, 2),
+                "eta_seconds": round(eta, 1) if eta is not None else None
+            }
+        if self.router:
+            d_snapshot["pacs"] = self.router.snapshot()
+        return d_snapshot
+
+    def write(self, force: bool = False):
+        """
+        Write the current snapshot, at most once per ``interval`` unless forced.
+        """
+        with self.write_lock:
+            now = time.monotonic()
+            if not force and now - self.last_write < self.interval:
+                return
+            self.last_write = now
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self.snapshot(), indent=2))
+            os.replace(tmp, self.path)
@@ -0,0 +1,117 @@
+from loguru import logger
+from pathlib import Path
+import csv
+import threading
+import time
+
+LOG = logger.debug
+
+FIELDS = ("workflow_id", "leaf_node_id", "status", "error", "wait_seconds", "run_seconds")
+
+
+def _cell(value):
+    # missing manifest values are NaN/NA; write them as empty cells
+    if value is None or (not isinstance(value, str) and str(value) in ("<NA>", "nan")):
+        return None
+    return value
+
+
+class ResultsWriter:
+    """
+    Stream one line per completed row to ``<stem>.results.csv``.
+
+    The CSV is flushed every ``flush_rows`` rows or ``flush_interval`` seconds,
+    whichever comes first, so the table can be followed while the run is in
+    progress; a background thread flushes the tail when rows stop completing. With ``parquet`` set, rows are also written to
+    ``<stem>.results.parquet`` in row groups of ``batch_size`` rows; this
+    requires pyarrow (``pip install pl-dyanon[parquet]``).
+    """
+
+    def __init__(self, path: Path, search_keys: list[str], parquet: bool = False, batch_size: int = 1000,
+                 flush_rows: int = 50, flush_interval: float = 5.0):
+        self.columns = ["row", *[f"search_{k}" for k in search_keys], *FIELDS]
+        self.search_keys = search_keys
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.unflushed = 0
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+
+        path = Path(path)
+        self.file = path.with_name(f"{path.stem}.results.csv").open("w", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(self.columns)
+        self.file.flush()
+
+        self.parquet = None
+        self.batch: list[list] = []
+        self.batch_size = batch_size
+        if parquet:
+            try:
+                self.parquet = self._open_parquet(path.with_name(f"{path.stem}.results.parquet"))
+            except ImportError:
+                logger.error("Parquet results need pyarrow; writing CSV only")
+
+        self.closed = threading.Event()
+        self.flusher = threading.Thread(target=self._flush_idle, name="results-flush", daemon=True)
+        self.flusher.start()
+
+    def _open_parquet(self, path: Path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        types = {"wait_seconds": pa.float64(), "run_seconds": pa.float64(), "row": pa.string()}
+        self.schema = pa.schema([(c, types.get(c, pa.string())) for c in self.columns])
+        return pq.ParquetWriter(path, self.schema)
+
+    def add(self, job, response: dict):
+        """
+        Append the outcome of a row.
+        """
+        values = [str(job.id), *[_cell(job.search.get(k)) for k in self.search_keys],
+                  *[_cell(response.get(f)) for f in FIELDS]]
+        with self.lock:
+            self.writer.writerow(["" if v is None else v for v in values])
+            self.unflushed += 1
+            if self.unflushed >= self.flush_rows or time.monotonic() - self.last_flush >= self.flush_interval:
+                self._flush()
+            if self.parquet:
+                self.batch.append(values)
+                if len(self.batch) >= self.batch_size:
+                    self._write_row_group()
+
+    def _flush_idle(self):
+        while not self.closed.wait(self.flush_interval):
+            with self.lock:
+                if self.unflushed and time.monotonic() - self.last_flush >= self.flush_interval:
+                    self._flush()
+
+    def _flush(self):
+        self.file.flush()
+        self.unflushed = 0
+        self.last_flush = time.monotonic()
+
+    def _write_row_group(self):
+        import pyarrow as pa
+
+        l_column = list(zip(*self.batch))
+        arrays = []
+        for name, values in zip(self.columns, l_column):
+            if pa.types.is_floating(self.schema.field(name).type):
+                values = [None if v is None else float(v) for v in values]
+            else:
+                values = [None if v is None else str(v) for v in values]
+            arrays.append(pa.array(values, type=self.schema.field(name).type))
+        self.parquet.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self.batch = []
+
+    def close(self):
+        self.closed.set()
+        self.flusher.join()
+        with self.lock:
+            self._flush()
+            self.file.close()
+            if self.parquet:
+                if self.batch:
+                    self._write_row_group()
+                self.parquet.close()
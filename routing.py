@@ -0,0 +1,172 @@
+from loguru import logger
+from policy import HourlyQuota, SubmissionWindows
+import threading
+import time
+
+LOG = logger.debug
+
+
+class PacsLane:
+    """
+    Admission state of one PACS: a concurrency limit, a submission rate limit
+    and a circuit breaker, plus the counters used for throughput reporting.
+
+    The breaker opens after ``max_failures`` consecutive failed rows. While it
+    is open the rows of this PACS are held back; after ``cooldown`` seconds a
+    single row is let through and its outcome closes or re-opens the breaker.
+
+    Outside of the submission ``windows`` or once the hourly ``quota`` is used
+    up, the lane pauses too; rows already in flight are unaffected.
+    """
+
+    def __init__(self, name: str, concurrency: int, rate: float = 0.0, max_failures: int = 5,
+                 cooldown: float = 300.0, windows: SubmissionWindows = None, quota: HourlyQuota = None):
+        self.name = name
+        self.windows = windows or SubmissionWindows()
+        self.quota = quota or HourlyQuota()
+        self.off_window = False
+        self.concurrency = max(1, concurrency)
+        self.interval = 60.0 / rate if rate > 0 else 0.0
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.next_slot = 0.0
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.submitted = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.first_submit = None
+        self.lock = threading.Lock()
+
+    def ready_in(self, images: float | None = 0.0) -> float:
+        """
+        Seconds until this lane may take another row of ``images`` images; 0 if it may right now.
+        Rows that don't load the PACS pass None and are not subject to the quota.
+        Rows blocked by the concurrency limit report ``inf`` until a row finishes.
+        """
+        closed_for = self.windows.seconds_until_open()
+        now = time.monotonic()
+        with self.lock:
+            if closed_for and not self.off_window:
+                logger.info(f"Pausing submissions to PACS {self.name} for {closed_for / 60:.0f} min outside "
+                            f"the submission windows; {self.in_flight} row(s) still in flight")
+            elif not closed_for and self.off_window:
+                logger.info(f"Resuming submissions to PACS {self.name}")
+            self.off_window = bool(closed_for)
+            if closed_for:
+                return closed_for
+            if self.opened_at is not None:
+                if self.probing:
+                    return float("inf")
+                wait = self.opened_at + self.cooldown - now
+                if wait > 0:
+                    return wait
+            if self.in_flight >= self.concurrency:
+                return float("inf")
+            quota_wait = self.quota.ready_in(images) if images is not None else 0.0
+            return max(0.0, self.next_slot - now, quota_wait)
+
+    def acquire(self, images: float | None = 0.0) -> bool:
+        """
+        Take a slot for one row of ``images`` images if the lane is ready.
+        """
+        if self.ready_in(images) > 0:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            if images is not None:
+                self.quota.record(images)
+            if self.opened_at is not None:
+                self.probing = True
+                logger.info(f"Probing PACS {self.name} after {self.cooldown}s cooldown")
+            self.in_flight += 1
+            self.submitted += 1
+            self.next_slot = max(self.next_slot, now) + self.interval
+            if self.first_submit is None:
+                self.first_submit = now
+        return True
+
+    def release(self, success: bool, seconds: float):
+        """
+        Free the slot of a finished row and update the circuit breaker.
+        """
+        with self.lock:
+            self.in_flight -= 1
+            self.busy_seconds += seconds
+            if success:
+                self.succeeded += 1
+                self.failures = 0
+                if self.opened_at is not None:
+                    logger.info(f"Closing circuit of PACS {self.name}")
+                self.opened_at = None
+                self.probing = False
+                return
+            self.failed += 1
+            self.failures += 1
+            if self.probing or (self.max_failures and self.failures >= self.max_failures):
+                if self.opened_at is None or self.probing:
+                    logger.warning(f"Opening circuit of PACS {self.name} after {self.failures} consecutive failures")
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            elapsed = time.monotonic() - self.first_submit if self.first_submit is not None else 0.0
+            done = self.succeeded + self.failed
+            return {
+                "in_flight": self.in_flight,
+                "submitted": self.submitted,
+                "succeeded": self.succeeded,
+                "failed": self.failed,
+                "circuit": "closed" if self.opened_at is None else ("probing" if self.probing else "open"),
+                "paused": self.off_window,
+                "throughput_per_minute": round(done / elapsed * 60, 2) if elapsed > 0 else 0.0,
+                "mean_seconds": round(self.busy_seconds / done, 1) if done else None
+            }
+
+
+class PacsRouter:
+    """
+    Route rows to per-PACS lanes so that a slow or failing archive only holds
+    back its own rows.
+
+    A row is routed by its ``pacs`` attribute, falling back to the run's
+    ``--PACSname``. Lanes are created on first use with the same limits and
+    submission windows, and an hourly quota of their own.
+    """
+
+    def __init__(self, default_pacs: str, concurrency: int, rate: float = 0.0, max_failures: int = 5,
+                 cooldown: float = 300.0, windows: SubmissionWindows = None, studies_per_hour: int = 0,
+                 images_per_hour: int = 0):
+        self.default_pacs = default_pacs
+        self.concurrency = concurrency
+        self.rate = rate
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.windows = windows
+        self.studies_per_hour = studies_per_hour
+        self.images_per_hour = images_per_hour
+        self.lanes: dict[str, PacsLane] = {}
+        self.lock = threading.Lock()
+
+    def route(self, job) -> str:
+        return job.pacs or self.default_pacs
+
+    def lane(self, job) -> PacsLane:
+        name = self.route(job)
+        with self.lock:
+            lane = self.lanes.get(name)
+            if lane is None:
+                LOG(f"Opening lane for PACS {name}")
+                lane = self.lanes[name] = PacsLane(name, self.concurrency, self.rate, self.max_failures,
+                                                   self.cooldown, self.windows,
+                                                   HourlyQuota(self.studies_per_hour, self.images_per_hour))
+            return lane
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            lanes = dict(self.lanes)
+        return {name: lane.snapshot() for name, lane in lanes.items()}
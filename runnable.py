@@ -4,6 +4,7 @@ from requests.auth import HTTPBasicAuth
 from requests.exceptions import RequestException, Timeout, HTTPError
 from tenacity import retry, wait_exponential, stop_after_attempt, retry_if_exception_type
 from loguru import logger
+from profiler import stage
 import time
 import asyncio
 from urllib.parse import urlencode
@@ -24,7 +25,8 @@ class Runnable:
     )
     def make_request(self, method: str, endpoint: str, **kwargs):
         url = f"{self.api_base}{endpoint}"
-        response = requests.request(method, url, headers=self.headers, timeout=30, **kwargs)
+        with stage("http_wait"):
+            response = requests.request(method, url, headers=self.headers, timeout=30, **kwargs)
         response.raise_for_status()
 
         try:
@@ -34,7 +36,8 @@ class Runnable:
 
     def post_request(self, endpoint: str, **kwargs):
         url = f"{self.api_base}{endpoint}"
-        response = requests.request("POST", url, headers=self.headers, timeout=30, **kwargs)
+        with stage("http_wait"):
+            response = requests.request("POST", url, headers=self.headers, timeout=30, **kwargs)
         response.raise_for_status()
 
         try:
@@ -0,0 +1,85 @@
+from loguru import logger
+from job import JobRecord
+import heapq
+import itertools
+import threading
+import time
+
+LOG = logger.debug
+
+POLICIES = ("fifo", "priority", "sjf")
+
+
+def _to_float(value, default: float) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class JobScheduler:
+    """
+    Order compiled jobs before they are dispatched.
+
+    Supported policies:
+        fifo     -- manifest order
+        priority -- highest ``priority`` first, ties broken by lowest cost
+        sjf      -- lowest ``cost`` (expected image count) first, ties broken by priority
+
+    Jobs without a priority default to 0; jobs without a cost estimate are
+    dispatched after all jobs with a known cost. ``aging`` is expressed in
+    priority (or cost) units per second waited, so that long-queued jobs
+    eventually overtake newer, more urgent ones.
+    """
+
+    def __init__(self, policy: str = "fifo", aging: float = 0.0):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown scheduling policy: {policy}")
+        self.policy = policy
+        self.aging = aging
+        self.heap = []
+        self.counter = itertools.count()
+        self.start = time.monotonic()
+        # jobs of unknown cost rank just behind the most expensive known job, so that aging can promote them
+        self.max_cost = 0.0
+        self.lock = threading.Lock()
+
+    def _base_key(self, job: JobRecord) -> tuple[float, bool, float]:
+        priority = _to_float(job.priority, 0.0)
+        cost = _to_float(job.cost, float("inf"))
+        unknown = cost == float("inf")
+        if self.policy == "priority":
+            return -priority, False, cost
+        if self.policy == "sjf":
+            return self.max_cost if unknown else cost, unknown, -priority
+        return 0.0, False, 0.0
+
+    def push(self, job: JobRecord):
+        """
+        Queue a job using the current time as its arrival time.
+        """
+        self.extend([job])
+
+    def extend(self, l_job: list[JobRecord]):
+        enqueued = time.monotonic() - self.start
+        with self.lock:
+            l_cost = [c for c in (_to_float(job.cost, float("inf")) for job in l_job) if c != float("inf")]
+            self.max_cost = max([self.max_cost, *l_cost])
+            for job in l_job:
+                key, unknown, tie = self._base_key(job)
+                # at pop time a job's effective key is key - aging * (now - enqueued); the
+                # aging * now term is the same for every queued job, so ordering the heap by
+                # key + aging * enqueued is ordering by the effective key at every pop
+                heapq.heappush(self.heap, (key + self.aging * enqueued, unknown, tie, next(self.counter), job))
+
+    def pop(self) -> JobRecord | None:
+        """
+        Return the next job to dispatch or None if the queue is empty.
+        """
+        with self.lock:
+            if not self.heap:
+                return None
+            return heapq.heappop(self.heap)[-1]
+
+    def __len__(self) -> int:
+        return len(self.heap)
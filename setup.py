@@ -25,7 +25,7 @@ setup(
     author='FNNDSC',
     author_email='dev@babyMRI.org',
     url='https://github.com/FNNDSC/pl-dy',
-    py_modules=['dyanon','base_client','chrisClient','pfdcm','chris_pacs_service','pipeline','runnable'],
+    py_modules=['dyanon','base_client','chrisClient','pfdcm','chris_pacs_service','pipeline','runnable','fanin','notification','scheduler','shard','admission','log_config','job','progress','journal','cancel','validate','routing','watch','results','policy','profiler','stages'],
     install_requires=['chris_plugin'],
     license='MIT',
     entry_points={
@@ -41,6 +41,9 @@ setup(
     ],
     extras_require={
         'none': [],
+        'parquet': [
+            'pyarrow'
+        ],
         'dev': [
             'pytest~=7.1'
         ]
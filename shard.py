@@ -0,0 +1,78 @@
+from loguru import logger
+from job import JobRecord
+from pathlib import Path
+import hashlib
+import json
+
+LOG = logger.debug
+
+
+def parse_shard(spec: str) -> (int, int):
+    """
+    Parse a shard specification of the form ``i/N`` with ``0 <= i < N``.
+    """
+    try:
+        index, count = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise ValueError(f"Invalid shard specification '{spec}', expected i/N")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Shard index out of range in '{spec}'")
+    return index, count
+
+
+def shard_of(job: JobRecord, count: int) -> int:
+    """
+    Return the shard a job belongs to, using a stable hash of its search directive
+    so that every instance computes the same partition of the manifest.
+    """
+    key = json.dumps(job.search, sort_keys=True, default=str)
+    digest = hashlib.sha1(key.encode()).digest()
+    return int.from_bytes(digest[:8], 'big') % count
+
+
+def select_shard(l_job: list[JobRecord], index: int, count: int) -> list[JobRecord]:
+    """
+    Keep only the jobs that belong to the given shard.
+    """
+    l_shard = [job for job in l_job if shard_of(job, count) == index]
+    LOG(f"Shard {index}/{count} holds {len(l_shard)} of {len(l_job)} rows")
+    return l_shard
+
+
+def manifest_name(index: int, count: int) -> str:
+    return f"shard-{index}-of-{count}.json"
+
+
+def write_manifest(output_file: Path, index: int, count: int, l_result: list[dict]):
+    """
+    Write the per-shard result manifest consumed by ``merge_manifests``.
+    """
+    d_manifest = {
+        "shard": index,
+        "count": count,
+        "leaf_node_ids": [d["leaf_node_id"] for d in l_result if d.get("leaf_node_id") is not None],
+        "results": l_result
+    }
+    output_file.write_text(json.dumps(d_manifest, indent=2, default=str))
+    LOG(f"Shard manifest written to {output_file}")
+
+
+def merge_manifests(l_file: list[Path]) -> dict:
+    """
+    Combine per-shard result manifests into one manifest for the reduce phase.
+    Raises an error if any shard of the partition is missing or duplicated.
+    """
+    l_manifest = [json.loads(Path(f).read_text()) for f in l_file]
+    if not l_manifest:
+        raise ValueError("No shard manifests found")
+    count = l_manifest[0]["count"]
+    shards = sorted(d["shard"] for d in l_manifest)
+    if any(d["count"] != count for d in l_manifest) or shards != list(range(count)):
+        raise ValueError(f"Incomplete or inconsistent shard manifests: {shards} of {count}")
+
+    l_manifest.sort(key=lambda d: d["shard"])
+    return {
+        "count": count,
+        "leaf_node_ids": [i for d in l_manifest for i in d["leaf_node_ids"]],
+        "results": [r for d in l_manifest for r in d["results"]]
+    }
@@ -0,0 +1,65 @@
+from loguru import logger
+import queue
+import threading
+
+LOG = logger.debug
+
+_STOP = object()
+
+
+class Stage:
+    """
+    A pool of ``workers`` threads handling the items of a bounded queue.
+
+    ``put`` blocks while the queue holds ``maxsize`` items, so a slow stage
+    holds back the stages feeding it. ``handler`` is called with one item at a
+    time and is responsible for forwarding its result to the next stage; an
+    exception it raises is passed to ``on_error`` together with the item.
+    Stages that need to drive their own loop pass a ``target`` instead, which
+    is called with the stage and reads items with ``get``.
+    """
+
+    def __init__(self, name: str, workers: int, handler=None, on_error=None, maxsize: int = 0, target=None):
+        self.name = name
+        self.handler = handler
+        self.on_error = on_error
+        self.queue = queue.Queue(maxsize)
+        self.threads = [threading.Thread(target=target or self._work, args=(self,) if target else (),
+                                         name=f"{name}-{i}", daemon=True)
+                        for i in range(max(1, workers))]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def get(self, timeout: float = None):
+        """
+        Take the next item, for stages that drive their own loop; raises ``queue.Empty`` on timeout.
+        """
+        return self.queue.get(timeout=timeout)
+
+    def _work(self):
+        while (item := self.queue.get()) is not _STOP:
+            self.run(item)
+
+    def run(self, item):
+        try:
+            self.handler(item)
+        except Exception as ex:
+            LOG(f"Stage {self.name} failed on {item}: {ex}")
+            if self.on_error:
+                self.on_error(item, ex)
+
+    def close(self):
+        """
+        Let the workers finish the queued items, then stop them.
+        """
+        for _ in self.threads:
+            self.queue.put(_STOP)
+        for thread in self.threads:
+            thread.join()
+
+    @staticmethod
+    def is_stop(item) -> bool:
+        return item is _STOP
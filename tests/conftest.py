@@ -0,0 +1,98 @@
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+REPO = Path(__file__).parent.parent
+
+PIPINGS = [(1, None, "PACS-query"), (2, 1, "PACS-retrieve"), (3, 2, "verify-registration")]
+PARAMS = {"PACS-query": ["PACSdirective"], "PACS-retrieve": ["PACSname"], "verify-registration": ["tagStruct"]}
+
+
+def items(*l_data: dict) -> dict:
+    return {"collection": {"items": [{"data": [{"name": k, "value": v} for k, v in d.items()]} for d in l_data]}}
+
+
+class StubServer(BaseHTTPRequestHandler):
+    """
+    Minimal CUBE and pfdcm endpoints used by a run without monitoring.
+    """
+    workflows = []
+    titles = []
+    lock = threading.Lock()
+
+    def reply(self, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path in ("/api/v1/", "/pfdcm/about/"):
+            self.reply({})
+        elif path == "/api/v1/pipelines/search/":
+            self.reply(items({"id": 1}))
+        elif path == "/api/v1/pipelines/1/pipings/":
+            self.reply(items(*[{"id": p[0]} for p in PIPINGS]))
+        elif path == "/api/v1/pipelines/1/parameters/":
+            self.reply(items(*[{"plugin_piping_id": i, "previous_plugin_piping_id": prev,
+                                "plugin_piping_title": title, "param_name": name, "value": None}
+                               for i, prev, title in PIPINGS for name in PARAMS[title]]))
+        elif match := re.match(r"/api/v1/pipelines/workflows/(\d+)/plugininstances/", path):
+            wf_id = int(match.group(1))
+            self.reply(items(*[{"id": wf_id * 10 + p[0]} for p in PIPINGS]))
+        elif path == "/api/v1/pipelines/workflows/search/":
+            query = parse_qs(urlparse(self.path).query)
+            title, offset, limit = query["title"][0], int(query["offset"][0]), int(query["limit"][0])
+            with self.lock:
+                l_match = [{"id": i + 1, "title": t} for i, t in enumerate(self.titles) if title in (t or "")]
+            self.reply(items(*l_match[offset:offset + limit]))
+        elif match := re.match(r"/api/v1/pipelines/workflows/(\d+)/", path):
+            self.reply(items({"id": int(match.group(1)), "finished_jobs": len(PIPINGS)}))
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.path == "/api/v1/pipelines/1/workflows/":
+            with self.lock:
+                self.workflows.append(json.loads(payload["nodes_info"]))
+                self.titles.append(payload.get("title"))
+                wf_id = len(self.workflows)
+            self.reply(items({"id": wf_id}))
+        else:
+            self.send_error(404)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_url():
+    StubServer.workflows = []
+    StubServer.titles = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubServer)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def run_dyanon(url: str, inputdir: Path, outputdir: Path, *args: str) -> subprocess.Popen:
+    outputdir.mkdir()
+    return subprocess.Popen([sys.executable, "dyanon.py",
+                             "--CUBEurl", f"{url}/api/v1/", "--CUBEtoken", "token",
+                             "--PFDCMurl", f"{url}/pfdcm/", "--pluginInstanceID", "1",
+                             *args, str(inputdir), str(outputdir)],
+                            cwd=REPO, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            env={**os.environ, "XDG_CACHE_HOME": str(outputdir.parent / "cache")})
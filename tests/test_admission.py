@@ -0,0 +1,63 @@
+import threading
+
+from admission import AdmissionController
+
+
+class FakePipe:
+    def __init__(self):
+        self.active = {}
+
+    def _get_workflow_status(self, workflow_id):
+        return {"active_jobs": self.active[workflow_id]}
+
+
+def test_submissions_hold_at_high_water_until_low_water():
+    pipe = FakePipe()
+    admission = AdmissionController(pipe, high_water=10, low_water=4, interval=0.01)
+    pipe.active = {1: 6, 2: 6}
+    admission.track(1, 6)
+    admission.track(2, 6)
+
+    released = threading.Event()
+    waiter = threading.Thread(target=lambda: (admission.wait(), released.set()))
+    waiter.start()
+    assert not released.wait(0.1)
+
+    # below the high-water mark but still above the low-water mark: keep holding
+    pipe.active = {1: 3, 2: 2}
+    assert not released.wait(0.1)
+
+    pipe.active = {1: 4, 2: 0}
+    assert released.wait(1)
+    waiter.join()
+    assert admission.tracked() == [1]
+    # back under the high-water mark, submissions are no longer held
+    admission.wait()
+
+
+def test_drained_workflows_are_pruned_without_admission_control():
+    pipe = FakePipe()
+    admission = AdmissionController(pipe, high_water=0, interval=0)
+    pipe.active = {1: 0, 2: 3}
+    admission.track(1, 3)
+    admission.track(2, 3)
+
+    admission.wait()
+    assert admission.tracked() == [2]
+
+
+def test_cancellation_releases_held_submissions():
+    pipe = FakePipe()
+    cancel_event = threading.Event()
+    admission = AdmissionController(pipe, high_water=10, interval=30, cancel_event=cancel_event)
+    pipe.active = {1: 100}
+    admission.track(1, 100)
+
+    released = threading.Event()
+    waiter = threading.Thread(target=lambda: (admission.wait(), released.set()))
+    waiter.start()
+    assert not released.wait(0.1)
+
+    cancel_event.set()
+    assert released.wait(1)
+    waiter.join()
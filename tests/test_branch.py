@@ -0,0 +1,62 @@
+import asyncio
+import csv
+from argparse import Namespace
+from pathlib import Path
+
+from dyanon import RunContext, process_manifest, share_retrieves
+from job import JobRecord
+from progress import DurationHistory, ProgressReporter
+from routing import PacsRouter
+
+
+class FakeClient:
+    def __init__(self):
+        self.calls = []
+
+    def compile(self, job, config):
+        return {}
+
+    def submit(self, job, pv_id, compiled):
+        self.calls.append((job.anon["PatientID"], job.branch_from))
+        d_ret = {"status": "Pipeline running", "workflow_id": 100 + job.id, "leaf_node_id": 200 + job.id}
+        if job.share_retrieve:
+            d_ret["retrieve_node_id"] = 300 + job.id
+        return d_ret
+
+    async def monitor(self, job, pv_id, compiled, submitted):
+        await asyncio.sleep(0)
+        return submitted
+
+
+class FakeNotifier:
+    def flush(self):
+        pass
+
+
+def test_share_retrieves_groups_by_search_and_pacs():
+    l_job = [JobRecord(0, {"PatientID": "1"}, {"PatientID": "a"}),
+             JobRecord(1, {"PatientID": "2"}, {"PatientID": "b"}),
+             JobRecord(2, {"PatientID": "1"}, {"PatientID": "c"}),
+             JobRecord(3, {"PatientID": "1"}, {"PatientID": "d"}, pacs="OTHER")]
+    l_first, d_branch = share_retrieves(l_job)
+    assert [job.id for job in l_first] == [0, 1, 3]
+    assert [job.id for job in d_branch[0]] == [2]
+    assert l_first[0].share_retrieve and not l_first[1].share_retrieve
+
+
+def test_profiles_branch_from_the_shared_retrieve(tmp_path: Path):
+    manifest = tmp_path / "manifest.csv"
+    manifest.write_text("search_PatientID,anon_PatientID\n1,a\n2,b\n1,c\n1,d\n")
+    client = FakeClient()
+    progress = ProgressReporter(tmp_path / "progress.json", DurationHistory(tmp_path / "history.json"), "anon", 2)
+    ctx = RunContext(None, client, FakeNotifier(), None, progress, None, PacsRouter("PACS", 2))
+    options = Namespace(requiredSearchKeys="", shard="", branchPipelineName="anon only", reducePipelineName="",
+                        resultsParquet=False, resultsBatch=1000, costPreQuery=False, schedule="fifo", aging=0.0,
+                        thread=True, maxThreads=2, pluginInstanceID=1, compileThreads=1,
+                        submitThreads=0, stageQueue=0)
+
+    l_result = process_manifest(options, ctx, manifest, tmp_path / "out.csv")
+
+    assert sorted(client.calls) == [("a", None), ("b", None), ("c", 300), ("d", 300)]
+    assert len(l_result) == 4
+    assert len(list(csv.DictReader((tmp_path / "out.results.csv").open()))) == 4
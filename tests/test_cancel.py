@@ -0,0 +1,71 @@
+import asyncio
+import json
+import signal
+import threading
+import time
+
+import pytest
+
+from cancel import Canceller
+from journal import Journal
+from pipeline import Pipeline
+
+
+class FakePipe:
+    def __init__(self):
+        self.requests = []
+
+    def make_request(self, method, endpoint, **kwargs):
+        self.requests.append((method, endpoint))
+        if method == "GET":
+            return [{"data": [{"name": "id", "value": 11}, {"name": "status", "value": "finishedSuccessfully"}]},
+                    {"data": [{"name": "id", "value": 12}, {"name": "status", "value": "started"}]}]
+        return []
+
+
+class FakeTracker:
+    def tracked(self):
+        return [1]
+
+
+def test_signal_only_flags_the_run(tmp_path):
+    pipe = FakePipe()
+    canceller = Canceller(pipe, FakeTracker(), Journal(tmp_path / "journal.jsonl"))
+
+    canceller._on_signal(signal.SIGTERM, None)
+
+    assert canceller.is_set() and canceller.reason == "SIGTERM"
+    assert pipe.requests == []
+    # a second signal ends the process
+    with pytest.raises(KeyboardInterrupt):
+        canceller._on_signal(signal.SIGINT, None)
+
+
+def test_cancel_workflows_cancels_unfinished_instances_once(tmp_path):
+    pipe = FakePipe()
+    canceller = Canceller(pipe, FakeTracker(), Journal(tmp_path / "journal.jsonl"))
+    canceller.cancel_workflows()
+    assert pipe.requests == []
+
+    canceller.request("deadline")
+    canceller.cancel_workflows()
+    canceller.cancel_workflows()
+
+    assert pipe.requests == [("GET", "/pipelines/workflows/1/plugininstances/"), ("PUT", "/plugins/instances/12/")]
+    l_entry = [json.loads(line) for line in (tmp_path / "journal.jsonl").read_text().splitlines()]
+    assert len(l_entry) == 1
+    assert l_entry[0]["event"] == "cancel" and l_entry[0]["reason"] == "deadline"
+    assert l_entry[0]["cancelled_instances"] == [12] and l_entry[0]["failed_instances"] == []
+
+
+def test_monitor_stops_polling_when_cancelled():
+    event = threading.Event()
+    pipe = Pipeline("http://cube/api/v1/", "token", cancel_event=event)
+    pipe._get_workflow_status = lambda workflow_id: {"workflow_failed": False, "workflow_cancelled": False,
+                                                     "finished_jobs": 0, "total_jobs": 3}
+    threading.Timer(0.1, event.set).start()
+
+    start = time.monotonic()
+    d_final = asyncio.run(pipe.monitor_pipeline(1, 3, 7, "admin@example.org", "smtp", json.dumps({})))
+    assert time.monotonic() - start < 5
+    assert d_final["status"] == "Failed"
@@ -0,0 +1,71 @@
+from fanin import FanIn
+
+
+class FakeRunnable:
+    def __init__(self):
+        self.next_id = 1000
+        self.joined = []
+
+    def run_plugin(self, pv_id, plugin_name, plugin_params):
+        self.next_id += 1
+        self.joined.append(plugin_params["plugininstances"].split(","))
+        return self.next_id
+
+
+def test_fan_in_joins_groups_into_single_root():
+    run_obj = FakeRunnable()
+    fan_in = FanIn(run_obj, 4, "dcm")
+    for inst_id in range(10):
+        fan_in.add(inst_id)
+
+    # two full groups are launched before the map phase ends
+    assert len(run_obj.joined) == 2
+
+    root = fan_in.finalize()
+    assert root == run_obj.next_id
+    assert all(len(group) <= 4 for group in run_obj.joined)
+    leaves = [int(i) for group in run_obj.joined for i in group if int(i) < 1000]
+    assert sorted(leaves) == list(range(10))
+
+
+def test_fan_in_single_leaf_is_still_copied():
+    run_obj = FakeRunnable()
+    fan_in = FanIn(run_obj, 4, "dcm")
+    fan_in.add(7)
+    assert fan_in.finalize() == 1001
+    assert run_obj.joined == [["7"]]
+
+
+class FlakyRunnable(FakeRunnable):
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+
+    def run_plugin(self, pv_id, plugin_name, plugin_params):
+        if self.failures:
+            self.failures -= 1
+            return -1
+        return super().run_plugin(pv_id, plugin_name, plugin_params)
+
+
+def test_failed_join_keeps_its_leaves():
+    run_obj = FlakyRunnable(failures=1)
+    fan_in = FanIn(run_obj, 2, "dcm")
+    for inst_id in range(4):
+        fan_in.add(inst_id)
+
+    root = fan_in.finalize()
+    assert root == run_obj.next_id
+    leaves = [int(i) for group in run_obj.joined for i in group if int(i) < 1000]
+    assert sorted(leaves) == list(range(4))
+
+
+def test_join_runs_outside_the_lock():
+    run_obj = FakeRunnable()
+    fan_in = FanIn(run_obj, 2, "dcm")
+    l_locked = []
+    run_plugin = run_obj.run_plugin
+    run_obj.run_plugin = lambda *args: (l_locked.append(fan_in.lock.locked()), run_plugin(*args))[1]
+    for inst_id in range(4):
+        fan_in.add(inst_id)
+    assert l_locked == [False] * 3
@@ -0,0 +1,51 @@
+import json
+
+from loguru import logger
+
+from log_config import LogFilter, _json_format, _redact_record, redact
+
+
+def test_redact_key_value_secrets():
+    assert redact("password: x, CUBEtoken='abc'") == "password: ***, CUBEtoken='***'"
+    assert redact('{"Authorization": "Token abc"}') == '{"Authorization": "***"}'
+
+
+def test_redact_name_value_pairs_of_nodes_info():
+    nodes_info = [{"piping_id": 1, "plugin_parameter_defaults": [
+        {"name": "orthancPassword", "default": 's3"c,r}t'},
+        {"name": "orthancUrl", "default": "http://orthanc:8042"},
+        {"name": "CUBEtoken", "type": "str", "value": 12345}]}]
+
+    for message in (json.dumps(nodes_info), json.dumps({"nodes_info": json.dumps(nodes_info)}), str(nodes_info)):
+        masked = redact(message)
+        assert "s3" not in masked and "r}t" not in masked and "12345" not in masked
+        assert "http://orthanc:8042" in masked
+    assert json.loads(redact(json.dumps(nodes_info)))[0]["plugin_parameter_defaults"][0]["default"] == "***"
+
+
+def test_json_sink_writes_redacted_records():
+    l_line = []
+    handler = logger.add(l_line.append, format=_json_format, level=0, filter=LogFilter("DEBUG"))
+    try:
+        logger.patch(_redact_record).bind(job_id=3, pacs="PACS").info("posting with password: hunter2")
+    finally:
+        logger.remove(handler)
+
+    d_line = json.loads(l_line[0])
+    assert d_line["level"] == "INFO" and d_line["job_id"] == 3 and d_line["pacs"] == "PACS"
+    assert d_line["message"] == "posting with password: ***"
+
+
+def record(name: str, level: str, **extra) -> dict:
+    return {"name": name, "level": logger.level(level), "extra": extra}
+
+
+def test_log_filter_module_levels_and_row_sampling():
+    log_filter = LogFilter("INFO", "pfdcm=WARNING,pipeline=DEBUG", sample=3)
+    assert not log_filter(record("dyanon", "DEBUG"))
+    assert log_filter(record("dyanon", "INFO"))
+    assert not log_filter(record("pfdcm", "INFO"))
+    assert log_filter(record("pipeline", "DEBUG"))
+    # one in three row events is kept, other records are never sampled
+    assert [log_filter(record("pipeline", "DEBUG", row_event=True)) for _ in range(6)] == [True, False, False] * 2
+    assert log_filter(record("pipeline", "DEBUG"))
@@ -0,0 +1,45 @@
+import time
+
+from notification import NotificationAggregator
+
+
+class FakeRunnable:
+    def __init__(self):
+        self.instances = []
+
+    def get_feed_id_from_plugin_inst(self, pv_id):
+        return pv_id // 10
+
+    def get_feed_details_from_id(self, feed_id):
+        return {"name": f"feed {feed_id}", "date": "today", "owner": "chris"}
+
+    def get_plugin_id(self, params):
+        return 5
+
+    def create_plugin_instance(self, plugin_id, params):
+        self.instances.append(params)
+        return len(self.instances)
+
+
+def test_failures_are_batched_per_feed_and_recipients():
+    run_obj = FakeRunnable()
+    notifier = NotificationAggregator(run_obj)
+    notifier.add(11, "Pipeline failed with errors", "a@x.org", "smtp", {"PatientID": "1"})
+    notifier.add(12, "Pipeline cancelled", "a@x.org", "smtp", {"PatientID": "2"})
+    notifier.add(21, "Pipeline failed with errors", "a@x.org", "smtp", {"PatientID": "3"})
+    assert run_obj.instances == []
+
+    assert notifier.flush() == [1, 2]
+    assert run_obj.instances[0]["title"] == "2 pipeline failure(s) in feed feed 1"
+    assert "'PatientID': '2'" in run_obj.instances[0]["content"]
+    assert notifier.flush() == []
+
+
+def test_lone_failure_is_sent_when_the_window_expires():
+    run_obj = FakeRunnable()
+    notifier = NotificationAggregator(run_obj, window=0.1)
+    notifier.add(11, "Pipeline failed with errors", "a@x.org", "smtp", {"PatientID": "1"})
+    time.sleep(0.4)
+
+    assert len(run_obj.instances) == 1
+    assert notifier.flush() == []
@@ -0,0 +1,63 @@
+import pfdcm
+
+
+def series(description: str, accession: str, count: int) -> dict:
+    return {
+        "SeriesDescription": {"value": description},
+        "AccessionNumber": {"value": accession},
+        "NumberOfSeriesRelatedInstances": {"value": str(count)},
+        "SeriesInstanceUID": {"value": f"1.{count}"},
+        "StudyInstanceUID": {"value": f"2.{accession}"},
+    }
+
+
+RESPONSE = {"status": True, "pypx": {"data": [
+    {"series": [series("T1 axial", "A1", 10), series("T2", "A1", 20)]},
+    {"series": [series("T1 sagittal", "A2", 5)]},
+]}}
+
+
+def test_compatible_directives_share_one_query(monkeypatch):
+    l_query = []
+    monkeypatch.setattr(pfdcm, "get_pfdcm_status", lambda query, url, pacs: l_query.append(query) or RESPONSE)
+    l_directive = [
+        {"PatientID": "1", "AccessionNumber": "A1", "SeriesDescription": "t1"},
+        {"PatientID": "1", "AccessionNumber": "A2"},
+        {"PatientID": "1", "AccessionNumber": "A1"},
+    ]
+    l_response = pfdcm.query_coalesced(l_directive, "http://pfdcm/", "PACS")
+
+    assert l_query == [{"PatientID": "1"}]
+    counts = [pfdcm.autocomplete_directive(d, r)[1] for d, r in zip(l_directive, l_response)]
+    assert counts == [10, 5, 30]
+
+
+def test_directive_queried_alone_is_sanitized(monkeypatch):
+    l_query = []
+    d_a1 = {**RESPONSE, "pypx": {"data": RESPONSE["pypx"]["data"][:1]}}
+    monkeypatch.setattr(pfdcm, "get_pfdcm_status", lambda query, url, pacs: l_query.append(query) or d_a1)
+    l_directive = [{"AccessionNumber": "A1", "SeriesDescription": "T1"}]
+    l_response = pfdcm.query_coalesced(l_directive, "http://pfdcm/", "PACS")
+
+    # pfdcm can't match partial text, so the description is only applied to the response
+    assert l_query == [{"AccessionNumber": "A1"}]
+    assert pfdcm.autocomplete_directive(l_directive[0], l_response[0])[1] == 10
+
+
+def test_split_response_matches_date_ranges():
+    d_response = {"pypx": {"data": [{"series": [{"SeriesDate": {"value": "20240105"}},
+                                                {"SeriesDate": {"value": "20240301"}}]}]}}
+    d_split = pfdcm.split_response({"SeriesDate": "20240101-20240131"}, d_response)
+    assert d_split["pypx"]["data"][0]["series"] == [{"SeriesDate": {"value": "20240105"}}]
+
+
+def test_split_response_handles_missing_and_numeric_values():
+    d_response = {"pypx": {"data": [{"series": [
+        {"SeriesNumber": {"value": 3}, "PatientName": {"value": None}},
+        {"SeriesNumber": {"value": "4"}, "PatientName": {"value": "DOE^JOHN"}},
+    ]}]}}
+    d_split = pfdcm.split_response({"SeriesNumber": 3}, d_response)
+    assert [s["SeriesNumber"]["value"] for s in d_split["pypx"]["data"][0]["series"]] == [3]
+
+    d_split = pfdcm.split_response({"PatientName": "doe"}, d_response)
+    assert [s["SeriesNumber"]["value"] for s in d_split["pypx"]["data"][0]["series"]] == ["4"]
@@ -0,0 +1,181 @@
+import copy
+import json
+from pathlib import Path
+
+import pytest
+from requests.exceptions import Timeout
+
+from conftest import StubServer, run_dyanon
+from job import JobRecord, RunConfig
+from pipeline import (POST_ATTEMPTS, Pipeline, SubmittedWorkflows, TemplateCache, WorkflowTemplate,
+                      compute_workflow_nodes_info, update_plugin_parameters)
+
+
+def make_defaults():
+    l_param = []
+    for piping_id, title in enumerate(["PACS-query", "PACS-retrieve", "verify-registration", "dicom-anon"]):
+        for name in ["PACSurl", "PACSname", "PACSdirective", "tagStruct", "CUBEurl"]:
+            l_param.append({
+                "plugin_piping_id": piping_id,
+                "previous_plugin_piping_id": piping_id - 1 if piping_id else None,
+                "plugin_piping_title": title,
+                "param_name": name,
+                "value": None
+            })
+    return l_param
+
+
+def make_config():
+    return RunConfig(cube_url="http://cube", pull_url="http://pfdcm", pacs_name="PACS", recipients="",
+                     smtp_server="", orthanc_url="", orthanc_username="", orthanc_password="",
+                     push_to_remote="", preserve_tags="{}", img_count="0", dicom_filter="",
+                     pipeline_name="anon")
+
+
+def test_template_render_matches_full_rebuild():
+    config = make_config()
+    job = JobRecord(7, {"PatientID": "1234"}, {"PatientName": "anon"})
+    nodes_info = compute_workflow_nodes_info(make_defaults(), include_all_defaults=True)
+    template = WorkflowTemplate(1, len(nodes_info), copy.deepcopy(nodes_info)).specialize(config.params_template)
+    snapshot = json.dumps(template.nodes_info)
+
+    row_params = config.row_params(job)
+    full_params = {k: {**config.params_template.get(k, {}), **row_params.get(k, {})}
+                   for k in {**config.params_template, **row_params}}
+    expected = update_plugin_parameters(copy.deepcopy(nodes_info), full_params)
+
+    assert template.render(row_params) == expected
+    # rendering a row never leaks into the shared template
+    assert json.dumps(template.nodes_info) == snapshot
+
+
+class TimeoutOnceSession:
+    """
+    CUBE creates the workflow, but the response to the first post never arrives.
+    """
+
+    def __init__(self):
+        self.titles = []
+
+    def request(self, method, url, params=None, json=None, **kwargs):
+        response = FakeResponse()
+        if method == "POST":
+            self.titles.append(json["title"])
+            if len(self.titles) == 1:
+                raise Timeout("read timed out")
+            response.items = [{"id": len(self.titles)}]
+        elif url.endswith("/pipelines/workflows/search/"):
+            response.items = [{"id": i + 1, "title": t} for i, t in enumerate(self.titles) if params["title"] in t]
+        return response
+
+
+class FakeResponse:
+    items = []
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"collection": {"items": [{"data": [{"name": k, "value": v} for k, v in d.items()]}
+                                         for d in self.items]}}
+
+
+def test_timed_out_post_is_reconciled_not_repeated(monkeypatch):
+    monkeypatch.setattr("pipeline.time.sleep", lambda seconds: None)
+    session = TimeoutOnceSession()
+    pipe = Pipeline("http://cube/api/v1/", "token", session=session)
+
+    workflow_id = pipe.post_workflow_once(1, 7, [], "dyanon:7:key")
+
+    assert workflow_id == 1
+    assert session.titles == ["dyanon:7:key"]
+
+
+def test_missing_pipeline_is_not_cached():
+    class LookupSession:
+        def __init__(self):
+            self.known = False
+            self.lookups = 0
+
+        def request(self, method, url, params=None, json=None, **kwargs):
+            response = FakeResponse()
+            if "/pipelines/search/" in url:
+                self.lookups += 1
+                response.items = [{"id": 3}] if self.known else []
+            elif url.endswith("/pipings/?limit=100"):
+                response.items = [{"id": 1}]
+            return response
+
+    session = LookupSession()
+    pipe = Pipeline("http://cube/api/v1/", "token", templates=TemplateCache(), session=session)
+    with pytest.raises(RuntimeError, match="anon"):
+        pipe.get_template("anon", {})
+
+    # once the pipeline is uploaded, the next row finds it
+    session.known = True
+    assert pipe.get_template("anon", {}).pipeline_id == 3
+    assert session.lookups == 2
+
+
+class LostPostSession:
+    """
+    CUBE creates every posted workflow, but no response ever arrives and
+    the search only lists them once ``visible`` is set.
+    """
+
+    def __init__(self):
+        self.titles = []
+        self.visible = False
+
+    def request(self, method, url, params=None, json=None, **kwargs):
+        response = FakeResponse()
+        if method == "POST":
+            self.titles.append(json["title"])
+            raise Timeout("read timed out")
+        if url.endswith("/pipelines/workflows/search/") and self.visible:
+            response.items = [{"id": i + 1, "title": t} for i, t in enumerate(self.titles) if params["title"] in t]
+        return response
+
+
+def test_failed_post_is_looked_up_again(monkeypatch):
+    monkeypatch.setattr("pipeline.time.sleep", lambda seconds: None)
+    session = LostPostSession()
+    pipe = Pipeline("http://cube/api/v1/", "token", session=session, workflows=SubmittedWorkflows())
+    compiled = {"pipeline_id": 1, "nodes_info": [], "total_jobs": 4}
+
+    with pytest.raises(Timeout):
+        pipe.submit_workflow(compiled, 7, key="key")
+    assert len(session.titles) == POST_ATTEMPTS
+
+    session.visible = True
+    # the instance was indexed before the posts; the retry of the row must still see them
+    assert pipe.workflows.get(pipe, 7, "dyanon:7:key") == POST_ATTEMPTS
+
+
+def test_workflow_without_id_is_not_recorded():
+    class NoIdSession:
+        def request(self, method, url, params=None, json=None, **kwargs):
+            return FakeResponse()
+
+    pipe = Pipeline("http://cube/api/v1/", "token", session=NoIdSession(), workflows=SubmittedWorkflows())
+
+    with pytest.raises(RuntimeError, match="dyanon:7:key"):
+        pipe.submit_workflow({"pipeline_id": 1, "nodes_info": [], "total_jobs": 4}, 7, key="key")
+    assert pipe.workflows.get(pipe, 7, "dyanon:7:key") is None
+
+
+def test_rerun_reuses_submitted_workflows(tmp_path: Path, stub_url: str):
+    inputdir = tmp_path / "incoming"
+    inputdir.mkdir()
+    rows = "\n".join(f"{i},{i}" for i in range(5))
+    (inputdir / "manifest.csv").write_text(f"search_AccessionNumber,anon_PatientID\n{rows}\n")
+
+    assert run_dyanon(stub_url, inputdir, tmp_path / "first").wait(timeout=120) == 0
+    assert run_dyanon(stub_url, inputdir, tmp_path / "rerun").wait(timeout=120) == 0
+
+    # rows are posted once, titled after their idempotency key, and picked up again by the rerun
+    assert len(StubServer.workflows) == 5
+    assert all(title.startswith("dyanon:1:") for title in StubServer.titles)
+    l_first, l_rerun = [(tmp_path / d / "manifest.results.csv").read_text() for d in ("first", "rerun")]
+    assert sorted(line.split(",")[:3] for line in l_first.splitlines()) == \
+           sorted(line.split(",")[:3] for line in l_rerun.splitlines())
@@ -0,0 +1,37 @@
+from datetime import datetime
+
+import pytest
+
+from policy import HourlyQuota, SubmissionWindows
+
+
+def test_overnight_window_on_weekdays():
+    windows = SubmissionWindows("Mon-Fri 19:00-07:00")
+    # Tuesday 2024-01-02
+    assert windows.seconds_until_open(datetime(2024, 1, 2, 20, 0)) == 0
+    # still open early Wednesday, from Tuesday's window
+    assert windows.seconds_until_open(datetime(2024, 1, 3, 6, 59)) == 0
+    assert windows.seconds_until_open(datetime(2024, 1, 3, 7, 0)) == 12 * 3600
+    # Saturday morning is covered by Friday's window, Saturday evening waits for Monday
+    assert windows.seconds_until_open(datetime(2024, 1, 6, 6, 0)) == 0
+    assert windows.seconds_until_open(datetime(2024, 1, 6, 19, 0)) == 48 * 3600
+
+
+def test_windows_are_validated():
+    assert SubmissionWindows("").seconds_until_open() == 0
+    for spec in ("19:00", "Mon-Foo 19:00-07:00", "25:00-07:00"):
+        with pytest.raises(ValueError):
+            SubmissionWindows(spec)
+
+
+def test_hourly_quota_of_studies_and_images():
+    quota = HourlyQuota(studies=2, images=100)
+    assert quota.ready_in(60) == 0
+    quota.record(60)
+    assert quota.ready_in(30) == 0
+    assert quota.ready_in(50) > 3500
+    quota.record(30)
+    assert quota.ready_in(0) > 3500
+
+    # a row larger than the whole budget goes through once the hour is empty
+    assert HourlyQuota(images=100).ready_in(500) == 0
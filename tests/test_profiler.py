@@ -0,0 +1,34 @@
+import json
+import time
+from pathlib import Path
+
+import profiler
+from profiler import stage
+
+
+def test_profile_reports_exclusive_stage_times(tmp_path: Path):
+    profiler.start(0.002)
+    with stage("monitor_polling"):
+        time.sleep(0.05)
+        with stage("http_wait"):
+            time.sleep(0.1)
+    profiler.finish(tmp_path)
+
+    d_summary = json.loads((tmp_path / "profile-summary.json").read_text())
+    d_stage = d_summary["stages"]
+    assert d_stage["http_wait"]["calls"] == 1 and d_stage["http_wait"]["wall_seconds"] >= 0.1
+    # nested time is only accounted to the inner stage
+    assert 0.05 <= d_stage["monitor_polling"]["wall_seconds"] < 0.1
+    assert d_stage["http_wait"]["samples"] > d_stage["monitor_polling"]["samples"] > 0
+
+    l_line = (tmp_path / "profile.collapsed").read_text().splitlines()
+    assert any(line.startswith("http_wait;") and "test_profile_reports_exclusive_stage_times" in line
+               for line in l_line)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in l_line)
+
+
+def test_stage_is_a_no_op_without_profiler(tmp_path: Path):
+    with stage("csv_load"):
+        pass
+    profiler.finish(tmp_path)
+    assert not (tmp_path / "profile-summary.json").exists()
@@ -0,0 +1,46 @@
+import json
+import time
+from pathlib import Path
+
+from progress import DurationHistory, ProgressReporter, default_history_path
+
+
+def test_duration_history_is_read_back_by_the_next_run(tmp_path: Path):
+    path = tmp_path / "cache" / "pl-dyanon" / "duration_history.json"
+    history = DurationHistory(path)
+    history.record("anon", 100, 30.0)
+    history.record("anon", 120, 50.0)
+    history.record("anon", 1000, 400.0)
+
+    later = DurationHistory(path)
+    # 100 and 120 images share the 128 bucket
+    assert later.estimate("anon", 110) == 40.0
+    # unknown buckets fall back to the mean over the pipeline
+    assert later.estimate("anon", 5) == 160.0
+    assert later.estimate("other") is None
+
+
+def test_default_history_path_is_outside_the_output_dir(monkeypatch, tmp_path: Path):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    assert default_history_path() == tmp_path / "pl-dyanon" / "duration_history.json"
+
+
+def test_eta_from_history_then_from_throughput(tmp_path: Path):
+    history = DurationHistory(tmp_path / "history.json")
+    history.record("anon", None, 60.0)
+    progress = ProgressReporter(tmp_path / "progress.json", history, "anon", 2, interval=0)
+    progress.add_queued(10)
+
+    # nothing completed yet: 10 rows over 2 workers at 60s each
+    assert progress.snapshot()["eta_seconds"] == 300.0
+
+    for _ in range(4):
+        progress.submitted()
+    time.sleep(0.2)
+    for _ in range(4):
+        progress.finished(True)
+    snapshot = progress.snapshot()
+    # 6 remaining rows at the observed throughput of 4 rows in ~0.2s
+    assert snapshot["succeeded"] == 4 and snapshot["queued"] == 6
+    assert 0.2 <= snapshot["eta_seconds"] < 1.5
+    assert json.loads((tmp_path / "progress.json").read_text())["succeeded"] == 4
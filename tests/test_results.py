@@ -0,0 +1,68 @@
+import csv
+import time
+from argparse import Namespace
+from pathlib import Path
+
+from dyanon import RunContext, process_manifest
+from job import JobRecord
+from progress import DurationHistory, ProgressReporter
+from results import ResultsWriter
+from routing import PacsRouter
+
+
+def test_results_are_flushed_while_rows_complete(tmp_path: Path):
+    writer = ResultsWriter(tmp_path / "manifest.csv", ["PatientID", "StudyDate"], flush_rows=2)
+    path = tmp_path / "manifest.results.csv"
+
+    writer.add(JobRecord(0, {"PatientID": "1", "StudyDate": float("nan")}, {}),
+               {"status": "Pipeline running", "workflow_id": 11, "leaf_node_id": 13, "run_seconds": 1.5})
+    writer.add(JobRecord(3, {"PatientID": "2"}, {}), {"status": "Failed", "error": "timeout"})
+    # readable before the writer is closed
+    l_row = list(csv.DictReader(path.open()))
+    assert [r["row"] for r in l_row] == ["0", "3"]
+    assert l_row[0]["search_StudyDate"] == "" and l_row[0]["leaf_node_id"] == "13"
+    assert l_row[1]["status"] == "Failed" and l_row[1]["error"] == "timeout"
+
+    writer.close()
+    assert len(list(csv.DictReader(path.open()))) == 2
+
+
+def test_tail_is_flushed_when_rows_stop_completing(tmp_path: Path):
+    writer = ResultsWriter(tmp_path / "manifest.csv", ["PatientID"], flush_rows=50, flush_interval=0.1)
+    writer.add(JobRecord(0, {"PatientID": "1"}, {}), {"status": "Pipeline complete"})
+    time.sleep(0.5)
+    assert len(list(csv.DictReader((tmp_path / "manifest.results.csv").open()))) == 1
+    writer.close()
+
+
+class FailedWorkflowClient:
+    def compile(self, job, config):
+        return {}
+
+    def submit(self, job, pv_id, compiled):
+        return {"status": "Pipeline running", "workflow_id": job.id, "leaf_node_id": job.id}
+
+    async def monitor(self, job, pv_id, compiled, submitted):
+        return {**submitted, "status": "Failed", "error": "Pipeline failed with errors", "leaf_node_id": None}
+
+
+class FakeNotifier:
+    def flush(self):
+        pass
+
+
+def test_failed_workflows_are_recorded_as_failed(tmp_path: Path):
+    manifest = tmp_path / "manifest.csv"
+    manifest.write_text("search_PatientID,anon_PatientID\n1,a\n2,b\n")
+    progress = ProgressReporter(tmp_path / "progress.json", DurationHistory(tmp_path / "history.json"), "anon", 2)
+    ctx = RunContext(None, FailedWorkflowClient(), FakeNotifier(), None, progress, None, PacsRouter("PACS", 2))
+    options = Namespace(requiredSearchKeys="", shard="", branchPipelineName="", reducePipelineName="",
+                        resultsParquet=False, resultsBatch=1000, costPreQuery=False, schedule="fifo", aging=0.0,
+                        thread=True, maxThreads=2, pluginInstanceID=1, compileThreads=1,
+                        submitThreads=0, stageQueue=0)
+
+    process_manifest(options, ctx, manifest, tmp_path / "out.csv")
+
+    l_row = list(csv.DictReader((tmp_path / "out.results.csv").open()))
+    assert [(r["status"], r["error"]) for r in l_row] == [("Failed", "Pipeline failed with errors")] * 2
+    assert progress.snapshot()["failed"] == 2 and progress.snapshot()["succeeded"] == 0
@@ -0,0 +1,94 @@
+from argparse import Namespace
+import asyncio
+import time
+
+from dyanon import dispatch
+from job import JobRecord
+from pipeline import Pipeline
+from routing import PacsLane, PacsRouter
+from scheduler import JobScheduler
+
+
+class FakeClient:
+    def compile(self, job, config):
+        return {}
+
+    def submit(self, job, pv_id, compiled):
+        return {"status": "Pipeline running", "leaf_node_id": job.id}
+
+    async def monitor(self, job, pv_id, compiled, submitted):
+        await asyncio.sleep(0.2 if job.pacs == "SLOW" else 0.01)
+        return submitted
+
+
+def test_slow_pacs_does_not_hold_back_other_archives():
+    scheduler = JobScheduler()
+    scheduler.extend([JobRecord(i, {}, {}, pacs="SLOW") for i in range(3)])
+    scheduler.extend([JobRecord(i, {}, {}, pacs="FAST") for i in range(3, 6)])
+    router = PacsRouter("FAST", 1)
+    l_done = []
+
+    options = Namespace(thread=True, maxThreads=1, pluginInstanceID=1, compileThreads=1, submitThreads=0, stageQueue=0)
+    dispatch(options, None, FakeClient(), scheduler, lambda job, response: l_done.append(job.pacs), router=router)
+
+    # every FAST row completes while the first SLOW row is still running
+    assert l_done[:3] == ["FAST"] * 3
+    assert router.snapshot()["SLOW"]["succeeded"] == 3
+
+
+class FailingWorkflowClient(FakeClient):
+    """
+    Workflows are posted fine, but fail in CUBE while being monitored.
+    """
+
+    def __init__(self):
+        self.notified = []
+        self.pipe = Pipeline("http://cube/api/v1/", "token", notifier=self)
+        self.pipe._get_workflow_status = lambda workflow_id: {"workflow_failed": True, "workflow_cancelled": False,
+                                                              "finished_jobs": 1, "total_jobs": 3}
+
+    def add(self, *args):
+        self.notified.append(args)
+
+    def compile(self, job, config):
+        return {"total_jobs": 3, "recipients": "admin@example.org", "smtp_server": "smtp",
+                "search_data": "{}", "pipeline_name": "anon"}
+
+    def submit(self, job, pv_id, compiled):
+        return {"status": "Pipeline running", "workflow_id": job.id, "leaf_node_id": job.id}
+
+    async def monitor(self, job, pv_id, compiled, submitted):
+        return await self.pipe.await_workflow(compiled, submitted, pv_id)
+
+
+def test_failed_workflows_open_the_circuit():
+    scheduler = JobScheduler()
+    scheduler.extend([JobRecord(i, {}, {}) for i in range(4)])
+    router = PacsRouter("PACS", 1, max_failures=2, cooldown=0.1)
+    l_done = []
+
+    options = Namespace(thread=True, maxThreads=1, pluginInstanceID=1, compileThreads=1, submitThreads=0, stageQueue=0)
+    dispatch(options, None, FailingWorkflowClient(), scheduler, lambda job, response: l_done.append(response),
+             router=router)
+
+    assert [response["status"] for response in l_done] == ["Failed"] * 4
+    assert all(response["leaf_node_id"] is None for response in l_done)
+    snapshot = router.snapshot()["PACS"]
+    assert snapshot["failed"] == 4 and snapshot["succeeded"] == 0
+    assert snapshot["circuit"] == "open"
+
+
+def test_circuit_breaker_opens_and_probes_after_cooldown():
+    lane = PacsLane("PACS", concurrency=2, max_failures=2, cooldown=0.1)
+    for _ in range(2):
+        assert lane.acquire()
+        lane.release(False, 1.0)
+    assert lane.snapshot()["circuit"] == "open"
+    assert not lane.acquire()
+
+    time.sleep(0.15)
+    assert lane.acquire()
+    # only a single probe is let through
+    assert not lane.acquire()
+    lane.release(True, 1.0)
+    assert lane.snapshot()["circuit"] == "closed"
@@ -0,0 +1,57 @@
+import time
+
+import pytest
+
+from job import JobRecord
+from scheduler import JobScheduler
+
+
+def drain(scheduler: JobScheduler) -> list:
+    l_job = []
+    while (job := scheduler.pop()) is not None:
+        l_job.append(job.id)
+    return l_job
+
+
+def job(name: str, priority=None, cost=None) -> JobRecord:
+    return JobRecord(name, {}, {}, priority, cost)
+
+
+def test_fifo_keeps_manifest_order():
+    scheduler = JobScheduler("fifo")
+    scheduler.extend([job(n, priority=p) for n, p in [("a", 1), ("b", 9), ("c", 5)]])
+    assert drain(scheduler) == ["a", "b", "c"]
+
+
+def test_priority_dispatches_urgent_rows_first():
+    scheduler = JobScheduler("priority")
+    scheduler.extend([job("bulk"), job("urgent", priority="10"), job("normal", priority="1")])
+    assert drain(scheduler) == ["urgent", "normal", "bulk"]
+
+
+def test_sjf_puts_unknown_cost_last():
+    scheduler = JobScheduler("sjf")
+    scheduler.extend([job("big", cost="900"), job("unknown"), job("small", cost=3)])
+    assert drain(scheduler) == ["small", "big", "unknown"]
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        JobScheduler("random")
+
+
+def test_old_expensive_job_overtakes_new_cheap_ones():
+    scheduler = JobScheduler("sjf", aging=1000)
+    scheduler.extend([job("old", cost=100), job("unknown")])
+    time.sleep(0.2)
+    # 0.2s of waiting is worth 200 cost units: more than the gap to the new cheap jobs
+    scheduler.extend([job("new1", cost=1), job("new2", cost=2)])
+    assert drain(scheduler) == ["old", "unknown", "new1", "new2"]
+
+
+def test_without_aging_cheap_jobs_go_first():
+    scheduler = JobScheduler("sjf")
+    scheduler.extend([job("old", cost=100), job("unknown")])
+    time.sleep(0.05)
+    scheduler.extend([job("new1", cost=1), job("new2", cost=2)])
+    assert drain(scheduler) == ["new1", "new2", "old", "unknown"]
@@ -0,0 +1,56 @@
+import json
+from pathlib import Path
+
+import pytest
+
+import shard
+from conftest import StubServer, run_dyanon
+from job import JobRecord
+
+
+def test_parse_shard():
+    assert shard.parse_shard("2/5") == (2, 5)
+    for spec in ("5/5", "-1/2", "1", "a/b"):
+        with pytest.raises(ValueError):
+            shard.parse_shard(spec)
+
+
+def test_shards_partition_manifest():
+    l_job = [JobRecord(i, {"AccessionNumber": str(i)}, {}) for i in range(200)]
+    l_parts = [shard.select_shard(l_job, i, 4) for i in range(4)]
+    assert sorted(len(p) for p in l_parts) != [0, 0, 0, 200]
+    assert sum(len(p) for p in l_parts) == len(l_job)
+    assert shard.select_shard(l_job, 1, 4) == l_parts[1]
+
+
+def test_sharded_runs_against_stub_servers(tmp_path: Path, stub_url: str):
+    count = 3
+    inputdir = tmp_path / "incoming"
+    inputdir.mkdir()
+    rows = "\n".join(f"{i},{i}" for i in range(30))
+    (inputdir / "manifest.csv").write_text(f"search_AccessionNumber,anon_PatientID\n{rows}\n")
+
+    l_proc = [run_dyanon(stub_url, inputdir, tmp_path / f"shard{i}", "--shard", f"{i}/{count}")
+              for i in range(count)]
+    assert all(proc.wait(timeout=120) == 0 for proc in l_proc)
+
+    # every row is submitted exactly once across all shards
+    l_directive = [json.loads(param["default"])["AccessionNumber"]
+                   for nodes_info in StubServer.workflows for node in nodes_info
+                   for param in node["plugin_parameter_defaults"] if param["name"] == "PACSdirective"]
+    assert sorted(l_directive, key=int) == [str(i) for i in range(30)]
+    # each shard streams a results table for its own rows
+    assert sum(len((tmp_path / f"shard{i}" / "manifest.results.csv").read_text().splitlines()) - 1
+               for i in range(count)) == 30
+
+    # the merge step sees the shard outputs as its input
+    merge_in = tmp_path / "merge_in"
+    merge_in.mkdir()
+    for i in range(count):
+        name = shard.manifest_name(i, count)
+        (merge_in / name).write_text((tmp_path / f"shard{i}" / name).read_text())
+    assert run_dyanon(stub_url, merge_in, tmp_path / "merged", "--mergeShards").wait(timeout=120) == 0
+
+    d_merged = json.loads((tmp_path / "merged" / "merged-shards.json").read_text())
+    assert len(d_merged["results"]) == 30
+    assert len(set(d_merged["leaf_node_ids"])) == 30
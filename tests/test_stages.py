@@ -0,0 +1,38 @@
+import threading
+import time
+
+from stages import Stage
+
+
+def test_bounded_queue_holds_back_the_feeding_stage():
+    release = threading.Event()
+    l_done = []
+    stage = Stage("slow", 1, lambda item: (release.wait(), l_done.append(item)), maxsize=1)
+    stage.put(0)
+    time.sleep(0.05)
+    stage.put(1)
+
+    fed = threading.Event()
+    feeder = threading.Thread(target=lambda: (stage.put(2), fed.set()))
+    feeder.start()
+    # the worker is busy with 0 and 1 fills the queue, so putting 2 blocks
+    assert not fed.wait(0.1)
+    release.set()
+    assert fed.wait(1)
+    feeder.join()
+    stage.close()
+    assert l_done == [0, 1, 2]
+
+
+def test_errors_are_passed_on_with_their_item():
+    l_error = []
+
+    def handler(item):
+        if item % 2:
+            raise ValueError(item)
+
+    stage = Stage("odd", 2, handler, lambda item, ex: l_error.append((item, str(ex))))
+    for i in range(4):
+        stage.put(i)
+    stage.close()
+    assert sorted(l_error) == [(1, "1"), (3, "3")]
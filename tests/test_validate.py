@@ -0,0 +1,62 @@
+import json
+
+import pandas as pd
+import pytest
+
+from dyanon import create_query
+from job import RunConfig
+from validate import validate_manifest
+
+
+def test_rows_are_normalized_and_rejected_with_reasons():
+    df = pd.DataFrame({
+        "search_StudyDate": [" 2024-02-03 ", "20241301", "20240101-20240131", None],
+        "search_StudyInstanceUID": ["1.2.3", "1.2.3", "1.2.a", None],
+        "search_Modality": ["mr", "CT", "MR", None],
+        "anon_PatientName": ["a", "b", "c", "d"],
+    }, dtype=str)
+    df_clean, df_rejected = validate_manifest(df)
+
+    assert list(df_clean.index) == [0]
+    assert df_clean.loc[0, "search_StudyDate"] == "20240203"
+    assert df_clean.loc[0, "search_Modality"] == "MR"
+    assert df_rejected.loc[1, "reason"] == "invalid date in search_StudyDate"
+    assert df_rejected.loc[2, "reason"] == "invalid UID in search_StudyInstanceUID"
+    assert df_rejected.loc[3, "reason"] == "empty search"
+
+
+def test_required_search_keys():
+    df = pd.DataFrame({"search_PatientID": ["1", None], "search_AccessionNumber": ["a", "b"]}, dtype=str)
+    df_clean, df_rejected = validate_manifest(df, ["PatientID"])
+    assert list(df_clean.index) == [0]
+    assert df_rejected.loc[1, "reason"] == "missing search_PatientID"
+
+
+def test_malformed_column_names_are_rejected_before_dispatch():
+    with pytest.raises(ValueError):
+        validate_manifest(pd.DataFrame({"search_PatientID": ["1"], "anonPatientName": ["x"]}, dtype=str))
+
+
+def test_partially_empty_rows_render_without_nan():
+    df = pd.DataFrame({"search_AccessionNumber": [None, "a"], "search_PatientID": ["1", " "],
+                       "anon_PatientName": ["x", None]}, dtype=str)
+    df_clean, _ = validate_manifest(df)
+    config = RunConfig(cube_url="http://cube", pull_url="http://pfdcm", pacs_name="PACS", recipients="",
+                       smtp_server="", orthanc_url="", orthanc_username="", orthanc_password="",
+                       push_to_remote="", preserve_tags="{}", img_count="0", dicom_filter="",
+                       pipeline_name="anon")
+
+    l_directive = [config.row_params(job)["PACS-query"]["PACSdirective"] for job in create_query(df_clean)]
+
+    assert all("NaN" not in directive for directive in l_directive)
+    assert [json.loads(directive) for directive in l_directive] == [{"PatientID": "1"}, {"AccessionNumber": "a"}]
+
+
+def test_anon_rules_are_neither_checked_nor_normalized():
+    df = pd.DataFrame({"search_PatientID": ["1"], "anon_PatientBirthDate": ["%_strmsk|******01"],
+                       "anon_StudyInstanceUID": ["%_md5|StudyInstanceUID"], "anon_StudyDate": ["2024-02-03"],
+                       "anon_PatientSex": ["o"]}, dtype=str)
+    df_clean, df_rejected = validate_manifest(df)
+
+    assert df_rejected.empty
+    assert df_clean.loc[0].to_dict() == df.loc[0].to_dict()
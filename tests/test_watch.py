@@ -0,0 +1,47 @@
+import os
+import time
+from pathlib import Path
+
+from watch import ManifestWatcher
+
+
+def settle(path: Path):
+    past = time.time() - 10
+    os.utime(path, (past, past))
+
+
+def test_watcher_picks_up_new_and_changed_manifests(tmp_path: Path):
+    inputdir = tmp_path / "incoming"
+    inputdir.mkdir()
+    state = tmp_path / "watch-state.json"
+    first = inputdir / "first.csv"
+    first.write_text("search_PatientID\n1\n")
+
+    watcher = ManifestWatcher(inputdir, "**/*csv", state)
+    # manifests still being written are left for a later poll
+    assert watcher.poll() == []
+    settle(first)
+    assert watcher.poll() == [first]
+    watcher.mark_done(first)
+    assert watcher.poll() == []
+
+    # a restarted watcher remembers what it processed, but not rewritten manifests
+    first.write_text("search_PatientID\n1\n2\n")
+    settle(first)
+    assert ManifestWatcher(inputdir, "**/*csv", state).poll() == [first]
+
+
+def test_watcher_reads_complete_queue_lines(tmp_path: Path):
+    inputdir = tmp_path / "incoming"
+    (inputdir / "elsewhere").mkdir(parents=True)
+    queued = inputdir / "elsewhere" / "queued.txt"
+    queued.write_text("search_PatientID\n1\n")
+    settle(queued)
+    queue = inputdir / "queue.txt"
+    queue.write_text("elsewhere/queued.txt\nelsewhere/partial")
+
+    watcher = ManifestWatcher(inputdir, "**/*csv", tmp_path / "watch-state.json", "queue.txt")
+    assert watcher.poll() == [queued]
+    watcher.mark_done(queued)
+    assert watcher.poll() == []
+    assert watcher.queue_offset == len("elsewhere/queued.txt\n")
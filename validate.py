@@ -0,0 +1,110 @@
+from loguru import logger
+import pandas as pd
+import re
+
+LOG = logger.debug
+
+# search/anon columns are named <prefix>_<DICOM keyword>, optionally suffixed by pandas' `.n` for duplicates
+_column_re = re.compile(r"^[^_]*(search|anon)[^_]*_([A-Za-z][A-Za-z0-9]*)(\.\d+)?$", re.IGNORECASE)
+
+# value representations checked per DICOM keyword
+DATE_KEYS = ("StudyDate", "SeriesDate", "AcquisitionDate", "ContentDate", "PatientBirthDate")
+UID_SUFFIXES = ("InstanceUID", "ClassUID")
+UPPERCASE_KEYS = ("Modality", "PatientSex", "BodyPartExamined")
+
+_date_re = r"^(\d{8})?-?(\d{8})?$"
+_uid_re = r"^[0-9]+(\.[0-9]+)*$"
+
+
+def column_key(column: str) -> str:
+    """
+    Return the DICOM keyword of a search/anon column, as used by ``create_query``.
+    """
+    return str(column).split('.')[0].split('_')[1]
+
+
+def is_search_column(column) -> bool:
+    """
+    Return whether a column holds a search value; anon columns hold tag substitution rules,
+    which are not DICOM values and are neither checked nor normalized.
+    """
+    match = _column_re.match(str(column))
+    return bool(match) and match.group(1).lower() == "search"
+
+
+def check_columns(df: pd.DataFrame):
+    """
+    Raise an error if any search/anon column doesn't follow the <prefix>_<keyword> naming.
+    """
+    l_bad = [str(c) for c in df.columns
+             if ("search" in str(c).lower() or "anon" in str(c).lower()) and not _column_re.match(str(c))]
+    if l_bad:
+        raise ValueError(f"Malformed search/anon column names: {l_bad}")
+    if not any("search" in str(c).lower() for c in df.columns):
+        raise ValueError("Manifest has no search columns")
+
+
+def normalize(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Strip whitespace, turn empty cells into NaN, upper-case code string search values
+    and remove separators from ISO formatted search dates.
+    """
+    df = df.apply(lambda s: s.str.strip() if pd.api.types.is_string_dtype(s) else s)
+    df = df.replace("", pd.NA)
+    for column in df.columns:
+        if not is_search_column(column):
+            continue
+        key = column_key(column)
+        if key in UPPERCASE_KEYS:
+            df[column] = df[column].str.upper()
+        elif key in DATE_KEYS:
+            df[column] = df[column].str.replace(r"^(\d{4})[-/.](\d{2})[-/.](\d{2})$", r"\1\2\3", regex=True)
+    return df
+
+
+def validate_manifest(df: pd.DataFrame, required_keys: list[str] = ()) -> (pd.DataFrame, pd.DataFrame):
+    """
+    Normalize a manifest and split it into clean and rejected rows.
+
+    All checks are vectorized over whole columns; no network call is made. The
+    rejected frame carries a ``reason`` column listing every failed check.
+    """
+    check_columns(df)
+    df = normalize(df)
+
+    search_cols = [c for c in df.columns if "search" in str(c).lower()]
+    reasons = pd.Series("", index=df.index)
+
+    def reject(mask: pd.Series, reason: str):
+        nonlocal reasons
+        reasons = reasons.where(~mask.fillna(False).astype(bool), reasons + reason + "; ")
+
+    reject(df[search_cols].isna().all(axis=1), "empty search")
+
+    search_keys = {column_key(c): c for c in reversed(search_cols)}
+    for key in required_keys:
+        if key not in search_keys:
+            raise ValueError(f"Required search key {key} is not a column of the manifest")
+        reject(df[search_keys[key]].isna(), f"missing search_{key}")
+
+    for column in df.columns:
+        if not is_search_column(column):
+            continue
+        key = column_key(column)
+        values = df[column].dropna()
+        if key in DATE_KEYS:
+            bad = ~values.str.match(_date_re) | (values == "-")
+            bounds = values[~bad].str.extract(_date_re)
+            for bound in bounds.columns:
+                parsed = pd.to_datetime(bounds[bound], format="%Y%m%d", errors="coerce")
+                bad[bounds.index] |= bounds[bound].notna() & parsed.isna()
+            reject(bad.reindex(df.index, fill_value=False), f"invalid date in {column}")
+        elif key.endswith(UID_SUFFIXES):
+            bad = ~values.str.match(_uid_re) | (values.str.len() > 64)
+            reject(bad.reindex(df.index, fill_value=False), f"invalid UID in {column}")
+
+    rejected = reasons != ""
+    df_rejected = df[rejected].assign(reason=reasons[rejected].str.rstrip("; "))
+    if rejected.any():
+        logger.warning(f"Rejected {int(rejected.sum())} of {len(df)} manifest rows")
+    return df[~rejected], df_rejected
@@ -0,0 +1,85 @@
+from loguru import logger
+from pathlib import Path
+import json
+import os
+import time
+
+LOG = logger.debug
+
+# a manifest is picked up only once it hasn't been modified for this many seconds
+SETTLE_SECONDS = 1.0
+
+
+class ManifestWatcher:
+    """
+    Find new manifests for a long-running process.
+
+    Manifests are discovered by globbing the input directory and, optionally,
+    from a queue file to which paths are appended one per line. Relative queued
+    paths are resolved against the input directory. Every processed manifest is
+    remembered with its modification time and size in ``state_path``, so that a
+    restarted daemon neither reprocesses old manifests nor misses rewritten ones.
+    """
+
+    def __init__(self, inputdir: Path, pattern: str, state_path: Path, queue_file: str = ''):
+        self.inputdir = Path(inputdir)
+        self.pattern = pattern
+        self.state_path = Path(state_path)
+        self.queue_file = self.inputdir / queue_file if queue_file else None
+        try:
+            d_state = json.loads(self.state_path.read_text())
+        except (OSError, ValueError):
+            d_state = {}
+        self.done: dict[str, list] = d_state.get("done", {})
+        self.queue_offset: int = d_state.get("queue_offset", 0)
+        self.queued: list[str] = d_state.get("queued", [])
+
+    @staticmethod
+    def _signature(path: Path) -> list | None:
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def _read_queue(self):
+        if not self.queue_file or not self.queue_file.exists():
+            return
+        with self.queue_file.open() as f:
+            f.seek(self.queue_offset)
+            # only consume complete lines; a partially written entry is read on the next poll
+            while (line := f.readline()).endswith("\n"):
+                self.queue_offset = f.tell()
+                if line.strip():
+                    self.queued.append(line.strip())
+
+    def poll(self) -> list[Path]:
+        """
+        Return the manifests that are new or changed since they were last processed.
+        """
+        self._read_queue()
+        l_path = sorted(p for p in self.inputdir.glob(self.pattern) if p != self.queue_file)
+        l_path += [self.inputdir / p for p in self.queued]
+        now = time.time()
+        l_new = []
+        for path in dict.fromkeys(l_path):
+            sig = self._signature(path)
+            if sig is None or now - sig[0] / 1e9 < SETTLE_SECONDS:
+                continue
+            if self.done.get(str(path)) != sig:
+                l_new.append(path)
+        return l_new
+
+    def mark_done(self, path: Path):
+        """
+        Remember a processed manifest and persist the watcher state.
+        """
+        self.done[str(path)] = self._signature(path)
+        self.queued = [p for p in self.queued if self.inputdir / p != path]
+        self._save()
+
+    def _save(self):
+        tmp = self.state_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"done": self.done, "queue_offset": self.queue_offset, "queued": self.queued},
+                                  indent=2))
+        os.replace(tmp, self.state_path)